@@ -0,0 +1,139 @@
+# Copyright (c) 2016 Akuli
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Things that the benchmark scripts have in common.
+
+The benchmark scripts print their results and write them to a JSON
+file. The results are a JSON object with benchmark names as keys and
+numbers as values, and they can be compared to an older results file
+that is used as a baseline.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_parser(description, output, repeat=5):
+    """Return an argparse.ArgumentParser with the common options."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-o', '--output', default=output,
+        help="write the results to this JSON file, default: %(default)s")
+    parser.add_argument(
+        '-b', '--baseline',
+        help="compare the results to an older JSON file")
+    parser.add_argument(
+        '-t', '--threshold', type=float, default=0.25,
+        help="fail if a result is this much worse than the baseline, "
+             "default: %(default)s (25 percent)")
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=repeat,
+        help="run each benchmark this many times, default: %(default)s")
+    return parser
+
+
+def median(values):
+    """Return the median of values."""
+    return statistics.median(values)
+
+
+def percentile(values, percent):
+    """Return the value that percent percent of the values are below."""
+    values = sorted(values)
+    index = round(percent / 100 * (len(values) - 1))
+    return values[index]
+
+
+@contextlib.contextmanager
+def temporary_home():
+    """Make a temporary home directory and yield an environment for it.
+
+    The environment is a copy of os.environ, and QasteTray processes
+    started with it don't use the real user's settings and caches.
+    """
+    home = tempfile.mkdtemp(prefix='qastetray-benchmark-')
+    try:
+        env = dict(os.environ)
+        env['HOME'] = home
+        if 'APPDATA' in env and 'TEMP' in env:
+            # Windows, see qastetray/core/filepaths.py.
+            env['APPDATA'] = os.path.join(home, 'AppData')
+            env['TEMP'] = os.path.join(home, 'Temp')
+        env['PYTHONPATH'] = os.pathsep.join(
+            [TOPDIR] + env.get('PYTHONPATH', '').split(os.pathsep))
+        yield env
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def finish(results, args, lower_is_better=(), noise=0):
+    """Print and save results and compare them to a baseline.
+
+    Results whose names are in lower_is_better, or all results if
+    lower_is_better is None, are worse when they are bigger. Other
+    results are worse when they are smaller. Changes smaller than noise
+    are never considered worse, because tiny results vary a lot.
+
+    Exit with status 1 if a result is worse than the baseline by more
+    than args.threshold.
+    """
+    print()
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+        f.write('\n')
+    print("Results were written to {}.".format(args.output))
+    if args.baseline is None:
+        return
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+
+    regressions = []
+    print()
+    print("{:40} {:>12} {:>12} {:>8}".format(
+        "BENCHMARK", "BASELINE", "NOW", "CHANGE"))
+    for name in sorted(results):
+        if name not in baseline or not baseline[name]:
+            continue
+        old, new = baseline[name], results[name]
+        change = (new - old) / old
+        if lower_is_better is None or name in lower_is_better:
+            worse = change > args.threshold
+        else:
+            worse = -change > args.threshold
+        if abs(new - old) < noise:
+            worse = False
+        print("{:40} {:12.4g} {:12.4g} {:+7.1%}{}".format(
+            name, old, new, change, "  WORSE" if worse else ""))
+        if worse:
+            regressions.append(name)
+
+    if regressions:
+        sys.exit("{} benchmark(s) got worse than the baseline: {}".format(
+            len(regressions), ', '.join(regressions)))
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016 Akuli
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Benchmark pasting with local servers that pretend to be pastebins.
+
+The servers run in a separate process and speak the protocols of the
+bundled pastebins: dpaste's API, Ghostbin's redirecting /paste/new,
+the GitHub Gist API, hastebin's /documents/ with chunked uploads, Paste
+ofCode's form and termbin's raw TCP. The pastebins' HTTP connections
+are sent to the local servers by replacing pastebin_manager's shared
+adapters, and termbin's HOST and PORT are changed.
+
+For each pastebin, content size and concurrency level this measures:
+
+  NAME-SIZE-cN-pastes-per-second   pastes per second
+  NAME-SIZE-cN-p50                 median latency of a paste in seconds
+  NAME-SIZE-cN-p99                 99th percentile latency
+  NAME-SIZE-cN-peak-memory         peak Python memory use in bytes
+  NAME-SIZE-cN-errors              number of failed pastes
+
+The servers can be made slower with --delay and unreliable with --loss,
+which makes them close a fraction of the connections without
+responding. For example:
+
+    python3 benchmarks/pastebins.py -o pastebins.json
+    python3 benchmarks/pastebins.py -b pastebins.json --delay 0.05
+"""
+
+import asyncio
+import functools
+import http.server
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+import common
+
+
+# The hosts that the bundled pastebins connect to with HTTP.
+HTTP_HOSTS = [
+    ('http', 'dpaste.com'),
+    ('https', 'ghostbin.com'),
+    ('https', 'api.github.com'),
+    ('http', 'hastebin.com'),
+    ('http', 'paste.ofcode.org'),
+]
+
+SIZES = {'1k': 1024, '100k': 100 * 1024, '1M': 1024 * 1024}
+
+
+class _ServerMixin:
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def setup_fake(self, delay, loss):
+        self.delay = delay
+        self.loss = loss
+        self.ids = itertools.count(1)
+
+    def should_respond(self):
+        """Sleep for the delay and return False to lose a request."""
+        if self.delay:
+            time.sleep(self.delay)
+        return random.random() >= self.loss
+
+    def new_id(self):
+        return '{:x}'.format(next(self.ids))
+
+
+class _HTTPServer(_ServerMixin, http.server.ThreadingHTTPServer):
+    pass
+
+
+class _TCPServer(_ServerMixin, socketserver.ThreadingTCPServer):
+    pass
+
+
+class _HTTPHandler(http.server.BaseHTTPRequestHandler):
+    """Pretend to be the HTTP pastebins."""
+
+    protocol_version = 'HTTP/1.1'
+
+    # The headers and the body are written separately, and Nagle's
+    # algorithm would delay the body by tens of milliseconds.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        """Read and throw away the request's body."""
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    # Skip the trailer.
+                    while self.rfile.readline() not in {b'\r\n', b'\n', b''}:
+                        pass
+                    return
+                while size > 0:
+                    size -= len(self.rfile.read(min(size, 64 * 1024)))
+                self.rfile.readline()
+        else:
+            size = int(self.headers.get('Content-Length', 0))
+            while size > 0:
+                data = self.rfile.read(min(size, 64 * 1024))
+                if not data:
+                    return
+                size -= len(data)
+
+    def _respond(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self._read_body()
+        if not self.server.should_respond():
+            self.close_connection = True
+            return
+
+        path = urllib.parse.urlsplit(self.path).path
+        paste_id = self.server.new_id()
+        if path == '/api/v2/':
+            # dpaste
+            url = 'http://dpaste.com/{}\n'.format(paste_id)
+            self._respond(201, url.encode('ascii'))
+        elif path == '/paste/new':
+            # Ghostbin
+            self._respond(303, headers=[
+                ('Location', '/paste/' + paste_id)])
+        elif path == '/gists':
+            body = {'html_url': 'https://gist.github.com/' + paste_id}
+            self._respond(201, json.dumps(body).encode('ascii'),
+                          [('Content-Type', 'application/json')])
+        elif path == '/documents/':
+            # hastebin
+            self._respond(200, json.dumps({'key': paste_id}).encode('ascii'),
+                          [('Content-Type', 'application/json')])
+        elif path == '/':
+            # Paste ofCode
+            self._respond(302, headers=[('Location', '/' + paste_id)])
+        else:
+            self._respond(404)
+
+    def do_GET(self):
+        # The pages that Ghostbin and Paste ofCode redirect to.
+        self._respond(200, b'<html>a paste</html>',
+                      [('Content-Type', 'text/html')])
+
+
+class _TermbinHandler(socketserver.BaseRequestHandler):
+    """Pretend to be termbin."""
+
+    def handle(self):
+        while self.request.recv(64 * 1024):
+            pass
+        if self.server.should_respond():
+            url = 'https://termbin.com/{}\n'.format(self.server.new_id())
+            self.request.sendall(url.encode('ascii'))
+
+
+def _serve(delay, loss, connection):
+    """Run the servers until something is received from connection."""
+    http_server = _HTTPServer(('127.0.0.1', 0), _HTTPHandler)
+    tcp_server = _TCPServer(('127.0.0.1', 0), _TermbinHandler)
+    for server in [http_server, tcp_server]:
+        server.setup_fake(delay, loss)
+        threading.Thread(target=server.serve_forever).start()
+
+    connection.send((http_server.server_address[1],
+                     tcp_server.server_address[1]))
+    connection.recv()
+    for server in [http_server, tcp_server]:
+        server.shutdown()
+
+
+def _make_redirecting_adapter(port, pool_size):
+    """Return an adapter that sends all requests to the local server."""
+    import requests
+
+    class RedirectingAdapter(requests.adapters.HTTPAdapter):
+        def send(self, request, **kwargs):
+            parts = urllib.parse.urlsplit(request.url)
+            request.url = urllib.parse.urlunsplit(
+                ('http', '127.0.0.1:{}'.format(port)) + parts[2:])
+            return super().send(request, **kwargs)
+
+    return RedirectingAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+
+def _make_content_file(directory, size):
+    """Create a text file of size bytes and return its path."""
+    path = os.path.join(directory, 'content-{}.txt'.format(size))
+    line = 'This is a line of a QasteTray benchmark paste.\n'
+    with open(path, 'w') as f:
+        f.write((line * (size // len(line) + 1))[:size])
+    return path
+
+
+def run_pastes(pastebin_manager, pastebin, path, concurrency, count):
+    """Paste the file count times.
+
+    Return the time it took, a list of latencies and the number of
+    errors.
+    """
+    latencies = []
+    errors = []
+
+    def callback(index, result, elapsed):
+        if isinstance(result, Exception) or not result:
+            errors.append(result)
+        else:
+            latencies.append(elapsed)
+
+    pastes = [{
+        'pastebin': pastebin,
+        'content': functools.partial(open, path, 'rb'),
+        'expiry': pastebin.expiry_days[0],
+        'syntax': None,
+        'title': 'QasteTray benchmark',
+        'username': None,
+    } for i in range(count)]
+
+    start = time.perf_counter()
+    asyncio.run(pastebin_manager.paste_many_async(
+        pastes, limit=concurrency, return_exceptions=True,
+        callback=callback))
+    return time.perf_counter() - start, latencies, len(errors)
+
+
+def main():
+    """Run the benchmarks."""
+    parser = common.get_parser(
+        "Benchmark pasting to local fake pastebins.", 'pastebins.json',
+        repeat=1)
+    parser.add_argument(
+        '-p', '--pastebins', default=None,
+        help="comma-separated pastebin names, default: all bundled")
+    parser.add_argument(
+        '-s', '--sizes', default=','.join(SIZES),
+        help="comma-separated content sizes from {}, default: %(default)s"
+             .format(', '.join(SIZES)))
+    parser.add_argument(
+        '-c', '--concurrency', default='1,8,32',
+        help="comma-separated numbers of simultaneous pastes, "
+             "default: %(default)s")
+    parser.add_argument(
+        '-n', '--pastes', type=int, default=50,
+        help="number of pastes for each measurement, default: %(default)s")
+    parser.add_argument(
+        '--delay', type=float, default=0,
+        help="seconds to wait before responding, default: %(default)s")
+    parser.add_argument(
+        '--loss', type=float, default=0,
+        help="fraction of requests that get no response, "
+             "default: %(default)s")
+    args = parser.parse_args()
+    sizes = args.sizes.split(',')
+    concurrencies = [int(c) for c in args.concurrency.split(',')]
+
+    connection, server_connection = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(
+        target=_serve, args=(args.delay, args.loss, server_connection))
+    server_process.start()
+    if not connection.poll(30):
+        server_process.terminate()
+        sys.exit("The servers didn't start.")
+    http_port, tcp_port = connection.recv()
+
+    results = {}
+    with common.temporary_home() as env:
+        # Settings and caches are in the temporary home.
+        os.environ.update(env)
+        sys.path.insert(0, common.TOPDIR)
+        from qastetray.core import pastebin_manager, setting_manager
+
+        # The same content is pasted many times, so it must not be
+        # taken from the paste cache.
+        setting_manager.get('core.conf')['PasteCache']['enabled'] = 'no'
+
+        pastebin_manager.load()
+        pool_size = max(concurrencies)
+        for key in HTTP_HOSTS:
+            pastebin_manager._adapters[key] = _make_redirecting_adapter(
+                http_port, pool_size)
+        termbin = pastebin_manager.pastebins['termbin']
+        termbin.HOST = '127.0.0.1'
+        termbin.PORT = tcp_port
+
+        if args.pastebins is None:
+            names = sorted(pastebin_manager.pastebins)
+        else:
+            names = args.pastebins.split(',')
+
+        directory = tempfile.mkdtemp(prefix='qastetray-benchmark-')
+        try:
+            paths = {size: _make_content_file(directory, SIZES[size])
+                     for size in sizes}
+            print("{:40} {:>10} {:>10} {:>10} {:>10} {:>6}".format(
+                "BENCHMARK", "PASTES/S", "P50 MS", "P99 MS", "PEAK KB",
+                "ERRORS"))
+            for name, size, concurrency in itertools.product(
+                    names, sizes, concurrencies):
+                pastebin = pastebin_manager.pastebins[name]
+                prefix = '{}-{}-c{}-'.format(
+                    name.lower().replace(' ', '-'), size, concurrency)
+
+                speeds = []
+                latencies = []
+                errors = 0
+                for i in range(args.repeat):
+                    seconds, new_latencies, new_errors = run_pastes(
+                        pastebin_manager, pastebin, paths[size],
+                        concurrency, args.pastes)
+                    speeds.append(len(new_latencies) / seconds)
+                    latencies.extend(new_latencies)
+                    errors += new_errors
+
+                # Measuring memory is slow, so it's done separately.
+                tracemalloc.start()
+                run_pastes(pastebin_manager, pastebin, paths[size],
+                           concurrency, concurrency)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                results[prefix + 'pastes-per-second'] = common.median(speeds)
+                if latencies:
+                    results[prefix + 'p50'] = common.percentile(latencies, 50)
+                    results[prefix + 'p99'] = common.percentile(latencies, 99)
+                results[prefix + 'peak-memory'] = peak
+                results[prefix + 'errors'] = errors
+                print("{:40} {:10.1f} {:10.1f} {:10.1f} {:10.0f} {:6}".format(
+                    prefix.rstrip('-'), common.median(speeds),
+                    results.get(prefix + 'p50', 0) * 1000,
+                    results.get(prefix + 'p99', 0) * 1000,
+                    peak / 1024, errors))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+            connection.send('stop')
+            server_process.join()
+
+    lower_is_better = {name for name in results
+                       if not name.endswith('pastes-per-second')}
+    common.finish(results, args, lower_is_better)
+
+
+if __name__ == '__main__':
+    main()
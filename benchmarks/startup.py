@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016 Akuli
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Benchmark how long QasteTray takes to start.
+
+These things are measured:
+
+  cli-version          qastetray-cli --version
+  cli-pastebins        qastetray-cli --pastebins, which loads pastebins
+  gui-first-window     starting qastetray until its window is shown,
+                       with Qt's offscreen platform (needs PyQt5)
+  load-N-cold          pastebin_manager.load() with N pastebins and no
+                       pastebin index
+  load-N-warm          the same with an up to date pastebin index
+  import-NAME          loading a bundled pastebin
+
+All times are medians in seconds, measured in new Python processes with
+a temporary home directory. The N pastebins are the bundled pastebins
+and copies of dpaste.py and paste_ofcode.json in a copy of QasteTray.
+
+Run this file from anywhere, for example:
+
+    python3 benchmarks/startup.py -o startup.json
+    python3 benchmarks/startup.py -b startup.json
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import common
+
+
+PLUGIN_COUNTS = [6, 100, 1000]
+
+# This is ran in a new process for measuring load().
+LOAD_SCRIPT = '''
+import time
+from qastetray.core import pastebin_manager
+start = time.perf_counter()
+pastebin_manager.load()
+print(time.perf_counter() - start, len(pastebin_manager.pastebins))
+'''
+
+# This is ran in a new process for measuring loading a pastebin.
+IMPORT_SCRIPT = '''
+import os, sys, time
+from qastetray.core import pastebin_manager
+path = sys.argv[1]
+loader = pastebin_manager.loaders[os.path.splitext(path)[1]]
+start = time.perf_counter()
+loader(path)
+print(time.perf_counter() - start)
+'''
+
+
+def run_python(args, env, repeat):
+    """Run Python repeat times and return the median wall time."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        # The current directory comes first in sys.path, so running in
+        # the temporary home makes sure that PYTHONPATH is used.
+        subprocess.run([sys.executable] + args, env=env, check=True,
+                       stdout=subprocess.DEVNULL, cwd=env['HOME'])
+        times.append(time.perf_counter() - start)
+    return common.median(times)
+
+
+def run_script(script, args, env, repeat, before_each=None):
+    """Run a script that prints a time and return the median time."""
+    times = []
+    for i in range(repeat):
+        if before_each is not None:
+            before_each()
+        output = subprocess.run(
+            [sys.executable, '-c', script] + args, env=env, check=True,
+            stdout=subprocess.PIPE, universal_newlines=True,
+            cwd=env['HOME']).stdout
+        times.append(float(output.split()[0]))
+    return common.median(times)
+
+
+def gui_first_window(env, repeat):
+    """Return the median time until the GUI's first window is shown.
+
+    None is returned if PyQt5 is not installed.
+    """
+    env = dict(env, QT_QPA_PLATFORM='offscreen', QASTETRAY_PROFILE='1')
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'qastetray.qt_gui'], env=env,
+            cwd=env['HOME'], stderr=subprocess.PIPE, universal_newlines=True)
+        try:
+            # The profiler prints this when the window has been shown.
+            for line in process.stderr:
+                if 'first window shown' in line:
+                    times.append(time.perf_counter() - start)
+                    break
+                if line.startswith('ModuleNotFoundError'):
+                    return None
+        finally:
+            process.kill()
+            process.wait()
+    if not times:
+        return None
+    return common.median(times)
+
+
+def make_plugin_copies(topdir, count):
+    """Copy QasteTray to topdir and add pastebins until it has count."""
+    shutil.copytree(
+        os.path.join(common.TOPDIR, 'qastetray'),
+        os.path.join(topdir, 'qastetray'),
+        ignore=shutil.ignore_patterns('__pycache__'))
+    pastebindir = os.path.join(topdir, 'qastetray', 'pastebins')
+    existing = len(os.listdir(pastebindir))
+
+    with open(os.path.join(pastebindir, 'dpaste.py'), 'r') as f:
+        python_source = f.read()
+    with open(os.path.join(pastebindir, 'paste_ofcode.json'), 'r') as f:
+        json_source = f.read()
+
+    for number in range(count - existing):
+        if number % 2 == 0:
+            filename = 'copy{}.py'.format(number)
+            content = python_source.replace(
+                "name = 'dpaste'", "name = 'dpaste {}'".format(number))
+        else:
+            filename = 'copy{}.json'.format(number)
+            content = json_source.replace(
+                '"name": "Paste ofCode"',
+                '"name": "Paste ofCode {}"'.format(number))
+        with open(os.path.join(pastebindir, filename), 'w') as f:
+            f.write(content)
+
+
+def main():
+    """Run the benchmarks."""
+    parser = common.get_parser(
+        "Benchmark how long QasteTray takes to start.", 'startup.json')
+    args = parser.parse_args()
+    results = {}
+
+    def report(name, value):
+        if value is None:
+            print("{:30} skipped".format(name))
+        else:
+            print("{:30} {:8.1f} ms".format(name, value * 1000))
+            results[name] = value
+
+    with common.temporary_home() as env:
+        # The first run compiles .pyc files and creates the index.
+        run_python(['-m', 'qastetray.cli', '--pastebins'], env, 1)
+        report('cli-version', run_python(
+            ['-m', 'qastetray.cli', '--version'], env, args.repeat))
+        report('cli-pastebins', run_python(
+            ['-m', 'qastetray.cli', '--pastebins'], env, args.repeat))
+        report('gui-first-window', gui_first_window(env, args.repeat))
+
+        pastebindir = os.path.join(common.TOPDIR, 'qastetray', 'pastebins')
+        for filename in sorted(os.listdir(pastebindir)):
+            name, extension = os.path.splitext(filename)
+            if extension in {'.py', '.json'}:
+                report('import-' + name, run_script(
+                    IMPORT_SCRIPT, [os.path.join(pastebindir, filename)],
+                    env, args.repeat))
+
+    for count in PLUGIN_COUNTS:
+        with common.temporary_home() as env:
+            topdir = tempfile.mkdtemp(prefix='qastetray-benchmark-')
+            try:
+                make_plugin_copies(topdir, count)
+                env['PYTHONPATH'] = topdir
+
+                def remove_index():
+                    # The cache directory is different on Windows and
+                    # Mac OSX, but removing the whole home is easy.
+                    for path in os.listdir(env['HOME']):
+                        shutil.rmtree(os.path.join(env['HOME'], path),
+                                      ignore_errors=True)
+
+                # This compiles the copied pastebins to .pyc files.
+                run_script(LOAD_SCRIPT, [], env, 1)
+                report('load-{}-cold'.format(count), run_script(
+                    LOAD_SCRIPT, [], env, args.repeat, remove_index))
+                report('load-{}-warm'.format(count), run_script(
+                    LOAD_SCRIPT, [], env, args.repeat))
+            finally:
+                shutil.rmtree(topdir, ignore_errors=True)
+
+    # Differences of a few milliseconds are just noise.
+    common.finish(results, args, lower_is_better=None, noise=0.005)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,11 +22,20 @@
 """Run the CLI."""
 
 import argparse
+import functools
 from gettext import gettext as _
+import glob
+import json
+import os
 import sys
+import time
 
+# This must be imported first for profiling other imports.
+from qastetray import profiling
 from qastetray import VERSION
-from qastetray.core import pastebin_manager, load_gettext
+from qastetray.core import (pastebin_manager, pastebin_stats, paste_daemon,
+                            load_gettext, lock, recent_paste_manager,
+                            setting_manager, syntax_index)
 
 
 def error(msg, error_type=None):
@@ -58,18 +67,238 @@ class PastebinsAction(argparse.Action):
               _("Abbreviated name").upper())
         for abbreviated_name, full_name in self.__pastebin_names.items():
             print(full_name.ljust(20), abbreviated_name)
+        print()
+        print(_("Use {!r} for choosing the fastest working pastebin "
+                "automatically.").format(pastebin_stats.AUTO))
         parser.exit()
 
 
+def _choose_pastebin(args):
+    """Choose a pastebin that supports the arguments with pastebin_stats."""
+    paste_args = [arg for arg in ['title', 'username', 'syntax', 'expiry']
+                  if getattr(args, arg) is not None]
+    try:
+        expiry = None if args.expiry is None else int(args.expiry)
+    except ValueError:
+        error(_("invalid expiry {!r}").format(args.expiry))
+    try:
+        return pastebin_stats.choose(pastebin_manager.pastebins.values(),
+                                     paste_args, expiry)
+    except LookupError:
+        error(_("no pastebin supports the given options"))
+
+
+def _paste(pastebin, content, expiry, syntax, title, username, deadline):
+    """Paste with the daemon if it's running, otherwise in this process."""
+    if setting_manager.get('core.conf')['Daemon'].getboolean('forward'):
+        try:
+            return paste_daemon.paste(pastebin, content, expiry, syntax,
+                                      title, username, deadline)
+        except paste_daemon.NotRunning:
+            pass
+    return pastebin_manager.paste(pastebin, content, expiry, syntax, title,
+                                  username, deadline)
+
+
+def _queue_failed(filename, exception, kwargs):
+    """Queue a file that couldn't be pasted because of exception.
+
+    kwargs should be pastebin_manager.paste() arguments without the
+    content. Return the ticket ID or None if the paste wasn't queued.
+    """
+    if isinstance(exception, UnicodeError):
+        # Pasting it again would fail the same way.
+        return None
+    if not setting_manager.get('core.conf')['PasteQueue'].getboolean(
+            'queue-failed'):
+        return None
+
+    # The queue is imported only when it's actually used.
+    from qastetray.core import paste_queue
+    try:
+        with open(filename, 'rb') as f:
+            return paste_queue.add(
+                kwargs['pastebin'], f, kwargs['expiry'], kwargs['syntax'],
+                kwargs['title'], kwargs['username'], exception)
+    except OSError:
+        return None
+
+
+def _print_result(filename, result, elapsed, pastebin_name, title,
+                  ticket=None):
+    """Print a JSON line about a file pasted in batch mode."""
+    if isinstance(result, str):
+        recent_paste_manager.recent_pastes.add(
+            result, title or filename, pastebin_name)
+
+    line = {'input': filename, 'url': None, 'error': None, 'ticket': ticket,
+            'elapsed': round(elapsed, 3)}
+    if isinstance(result, UnicodeError):
+        line['error'] = _("non-Unicode input")
+    elif isinstance(result, Exception):
+        line['error'] = '{}: {}'.format(type(result).__name__, result)
+    else:
+        line['url'] = result
+    print(json.dumps(line), flush=True)
+
+
+def paste_batch(filenames, jobs, **kwargs):
+    """Paste many files concurrently.
+
+    A JSON object is printed on a line for each file when it has been
+    pasted. Files that fail are queued if they can be pasted later, and
+    their lines have the ticket IDs. Return True if all files were
+    pasted successfully.
+    """
+    # asyncio is imported here because importing it is slow, and most
+    # qastetray-cli runs don't need it.
+    import asyncio
+
+    # The files are opened in binary mode and pastebins that support it
+    # read them while pasting. Non-UTF-8 files give UnicodeErrors.
+    pastes = [dict(kwargs, content=functools.partial(open, filename, 'rb'))
+              for filename in filenames]
+    queued = []
+
+    def callback(index, result, elapsed):
+        ticket = None
+        if isinstance(result, Exception):
+            ticket = _queue_failed(filenames[index], result, kwargs)
+        if ticket is not None:
+            queued.append(ticket)
+        _print_result(filenames[index], result, elapsed,
+                      kwargs['pastebin'].name, kwargs['title'], ticket)
+
+    results = asyncio.run(pastebin_manager.paste_many_async(
+        pastes,
+        limit=jobs,
+        return_exceptions=True,
+        callback=callback,
+    ))
+    if queued:
+        from qastetray.core import paste_queue
+        paste_queue.start_worker()
+    return not any(isinstance(result, Exception) for result in results)
+
+
+def history(args):
+    """Run the history subcommand."""
+    parser = argparse.ArgumentParser(
+        prog='qastetray-cli history',
+        description=_("Search the recent pastes."),
+    )
+    parser.add_argument('action', choices=['search'])
+    parser.add_argument(
+        'query', nargs=argparse.ZERO_OR_MORE,
+        help=_("words in the title or URL, pastebin:NAME, on:YYYY-MM-DD, "
+               "after:YYYY-MM-DD or before:YYYY-MM-DD"))
+    parser.add_argument(
+        '-n', '--limit', type=int, default=20, metavar='N',
+        help=_("show at most N pastes, newest first"))
+    parser.add_argument(
+        '--profile', action='store_true',
+        help=_("print how long starting takes to stderr"))
+    args = parser.parse_args(args)
+
+    # This imports sqlite3, so it's not imported when it's not needed.
+    from qastetray.core import history_search
+    try:
+        results = history_search.search(' '.join(args.query), args.limit)
+    except ValueError as e:
+        error(str(e))
+    for paste in results:
+        print(time.strftime('%Y-%m-%d %H:%M', time.localtime(paste.time)),
+              paste.pastebin, paste.url, paste.title, sep='\t')
+
+
+def queue(args):
+    """Run the queue subcommand."""
+    parser = argparse.ArgumentParser(
+        prog='qastetray-cli queue',
+        description=_("Show or paste the queued pastes."),
+    )
+    parser.add_argument(
+        'action', nargs='?', choices=['list', 'drain'], default='list',
+        help=_("list shows the queued pastes and drain pastes them "
+               "now, list is the default"))
+    parser.add_argument(
+        'tickets', nargs=argparse.ZERO_OR_MORE, metavar='ticket',
+        help=_("show only these tickets"))
+    args = parser.parse_args(args)
+
+    from qastetray.core import paste_queue
+    if args.action == 'drain':
+        pastebin_manager.load()
+        if not paste_queue.drain():
+            error(_("the queue is already being pasted by another process"))
+        return
+
+    for entry in paste_queue.get_all():
+        if args.tickets and entry['ticket'] not in args.tickets:
+            continue
+        if entry['state'] == paste_queue.PENDING:
+            info = _("next try at {}").format(time.strftime(
+                '%H:%M:%S', time.localtime(entry['next_attempt'])))
+        else:
+            info = entry['url'] or entry['error']
+        print(entry['ticket'], entry['state'], entry['pastebin'], info,
+              sep='\t')
+
+
+def daemon(args):
+    """Run the daemon subcommand."""
+    parser = argparse.ArgumentParser(
+        prog='qastetray-cli daemon',
+        description=_("Keep pastebins loaded and connections open in the "
+                      "background, so pasting is faster."),
+    )
+    parser.add_argument(
+        'action', nargs='?', choices=['run', 'stop', 'status'],
+        default='run',
+        help=_("run the daemon in the foreground, stop it or check if "
+               "it's running, run is the default"))
+    args = parser.parse_args(args)
+
+    if args.action == 'stop':
+        if not paste_daemon.stop():
+            error(_("the daemon is not running"))
+    elif args.action == 'status':
+        pid = paste_daemon.get_pid()
+        if pid is None:
+            print(_("The daemon is not running."))
+            sys.exit(1)
+        print(_("The daemon is running with process ID {}.").format(pid))
+    else:
+        try:
+            paste_daemon.serve()
+        except lock.IsLocked:
+            error(_("the daemon is already running"))
+        except KeyboardInterrupt:
+            pass
+
+
 def main(args=None):
     """Run the CLI."""
     if args is None:
         args = sys.argv
 
-    load_gettext()
+    with profiling.phase("load_gettext"):
+        load_gettext()
+    with profiling.phase("recent_paste_manager.load"):
+        recent_paste_manager.load()
+    if args[1:2] == ['history']:
+        history(args[2:])
+        return
+    if args[1:2] == ['queue']:
+        queue(args[2:])
+        return
+    if args[1:2] == ['daemon']:
+        daemon(args[2:])
+        return
 
     # Get a dictionary of abbreviated pastebin names.
-    pastebin_manager.load()
+    with profiling.phase("pastebin_manager.load"):
+        pastebin_manager.load()
     full_name_dict = {}
     for full_name in pastebin_manager.pastebins.keys():
         abbreviated_name = full_name.lower().replace(' ', '-')
@@ -78,6 +307,10 @@ def main(args=None):
     parser = argparse.ArgumentParser(
         prog='qastetray-cli',
         description=_("Command-line interface for {}.").format("QasteTray"),
+        epilog=_("Use '{}' to search the recent pastes, '{}' to see the "
+                 "queued pastes and '{}' for faster pasting.").format(
+                     "qastetray-cli history search", "qastetray-cli queue",
+                     "qastetray-cli daemon"),
         add_help=False,
     )
 
@@ -95,30 +328,72 @@ def main(args=None):
 
     parser.add_argument(
         'pastebin',
-        help=_("an abbreviated pastebin name, see {}").format("--pastebins"))
+        help=_("an abbreviated pastebin name, see {}, {!r} for choosing "
+               "one automatically, or a comma-separated list of them for "
+               "using the fastest one").format(
+                   "--pastebins", pastebin_stats.AUTO))
+    parser.add_argument(
+        'files', nargs=argparse.ZERO_OR_MORE, metavar='file',
+        help=_("input files, defaults to standard input"))
+    parser.add_argument(
+        '-g', '--glob', action='append', default=[], metavar='PATTERN',
+        help=_("paste files matching a glob pattern"))
     parser.add_argument(
-        'file', nargs=argparse.OPTIONAL,
-        help=_("input file, defaults to standard input"))
+        '-0', '--null', action='store_true',
+        help=_("read NUL-separated file names from standard input"))
+    parser.add_argument(
+        '-j', '--jobs', type=int, metavar='N',
+        default=setting_manager.get('core.conf')['Pasting'].getint(
+            'concurrency'),
+        help=_("number of files to paste at the same time"))
     parser.add_argument(
         '-e', '--expiry',
         help=_("expiry in days, defaults to smallest possible"))
     parser.add_argument(
         '-s', '--syntax',
-        help=_("syntax highlighting, defaults to plain text"))
+        help=_("syntax highlighting, e.g. python or py3, detected from "
+               "the content by default"))
     parser.add_argument(
         '-t', '--title',
         help=_("the title of the paste"))
     parser.add_argument('-u', '--username', help=_("your username or nick"))
+    parser.add_argument(
+        '--stagger', type=float, metavar='SECONDS',
+        help=_("with many pastebins, seconds to wait before trying the "
+               "next pastebin"))
+    parser.add_argument(
+        '--queue', action='store_true',
+        help=_("paste in the background and print a ticket ID for each "
+               "input right away"))
+    parser.add_argument(
+        '--timeout', type=float, metavar='SECONDS',
+        help=_("give up if pasting takes longer than this, defaults to "
+               "the timeout setting"))
+    parser.add_argument(
+        '--profile', action='store_true',
+        help=_("print how long starting takes to stderr"))
 
-    args = parser.parse_args(args[1:])
+    args = parser.parse_intermixed_args(args[1:])
 
-    try:
-        pastebin_name = full_name_dict[args.pastebin]
-    except KeyError:
-        error(_("unknown pastebin {!r}").format(args.pastebin))
-    pastebin = pastebin_manager.pastebins[pastebin_name]
+    pastebins = []
+    for name in args.pastebin.split(','):
+        if name == pastebin_stats.AUTO:
+            pastebins.append(_choose_pastebin(args))
+            continue
+        try:
+            pastebin_name = full_name_dict[name]
+        except KeyError:
+            error(_("unknown pastebin {!r}").format(name))
+        pastebins.append(pastebin_manager.pastebins[pastebin_name])
+    pastebin = pastebins[0]
 
-    if args.expiry is None:
+    if len(pastebins) > 1:
+        # paste_hedged() chooses the closest expiry for each pastebin.
+        try:
+            expiry = None if args.expiry is None else int(args.expiry)
+        except ValueError:
+            error(_("invalid expiry {!r}").format(args.expiry))
+    elif args.expiry is None:
         expiry = pastebin.expiry_days[0]
     else:
         try:
@@ -130,24 +405,138 @@ def main(args=None):
             error(_("invalid expiry {expiry!r}, should be one of {should_be}")
                   .format(expiry=str(args.expiry), should_be=expirylist))
 
+    syntax = args.syntax
+    if (syntax is not None and len(pastebins) == 1 and
+            'syntax' in pastebin.paste_args):
+        # Allow things like py3 and python instead of requiring the
+        # pastebin's exact name for Python 3.
+        index = syntax_index.get(pastebin)
+        syntax = index.resolve(syntax)
+        if syntax is None:
+            candidates = index.search(args.syntax)
+            if candidates:
+                error(_("ambiguous syntax {!r}, could be {}").format(
+                    args.syntax, ', '.join(map(repr, candidates))))
+            error(_("unknown syntax {!r}").format(args.syntax))
+
+    # All pastes share the deadline, so batch mode finishes in time too.
+    if args.timeout is None:
+        deadline = None
+    else:
+        deadline = time.monotonic() + args.timeout
+
+    filenames = list(args.files)
+    unmatched_patterns = []
+    for pattern in args.glob:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            unmatched_patterns.append(pattern)
+        filenames.extend(matches)
+    if args.null:
+        # The names are bytes, and os.fsdecode() decodes them like the
+        # operating system's own file names.
+        filenames.extend(os.fsdecode(name)
+                         for name in sys.stdin.buffer.read().split(b'\0')
+                         if name)
+
+    if args.queue:
+        if len(pastebins) > 1:
+            error(_("{} can't be used with many pastebins").format(
+                "--queue"))
+        if unmatched_patterns:
+            error(_("no files match {!r}").format(unmatched_patterns[0]))
+        from qastetray.core import paste_queue
+        for filename in filenames or [None]:
+            if filename is None:
+                ticket = paste_queue.add(
+                    pastebin, sys.stdin.buffer, expiry, syntax, args.title,
+                    args.username)
+            else:
+                try:
+                    with open(filename, 'rb') as f:
+                        ticket = paste_queue.add(
+                            pastebin, f, expiry, syntax, args.title,
+                            args.username)
+                except OSError as e:
+                    error(str(e))
+            print(ticket, flush=True)
+        paste_queue.start_worker()
+        sys.exit()
+
+    if len(filenames) > 1 or args.glob or args.null:
+        # Batch mode, one JSON line is printed for each file.
+        if args.jobs < 1:
+            error(_("the number of jobs must be positive"))
+        if not filenames:
+            error(_("no input files"))
+        if len(pastebins) > 1:
+            error(_("only one input can be pasted to many pastebins"))
+        for pattern in unmatched_patterns:
+            print(json.dumps({
+                'input': pattern,
+                'url': None,
+                'error': _("no files match {!r}").format(pattern),
+                'ticket': None,
+                'elapsed': 0,
+            }), flush=True)
+
+        success = paste_batch(
+            filenames,
+            args.jobs,
+            pastebin=pastebin,
+            expiry=expiry,
+            syntax=syntax,
+            title=args.title,
+            username=args.username,
+            deadline=deadline,
+        )
+        sys.exit(0 if success and not unmatched_patterns else 1)
+
+    # This CLI shows complete error messages unlike the GUI's.
+    if len(pastebins) > 1:
+        def paste(content):
+            nonlocal pastebin
+            url, pastebin = pastebin_manager.paste_hedged(
+                pastebins, content, expiry, syntax, args.title,
+                args.username, args.stagger, deadline)
+            return url
+    else:
+        paste = functools.partial(
+            _paste,
+            pastebin=pastebin,
+            expiry=expiry,
+            syntax=syntax,
+            title=args.title,
+            username=args.username,
+            deadline=deadline,
+        )
+
+    # The content is not read here, so pastebins that support streaming
+    # can start pasting before all of it has been read.
     try:
-        if args.file is None:
-            content = sys.stdin.read()
+        if filenames:
+            with open(filenames[0], 'rb') as f:
+                url = paste(content=f)
         else:
-            with open(args.file, 'r') as f:
-                content = f.read()
+            url = paste(content=sys.stdin.buffer)
     except UnicodeError:
         error(_("non-Unicode input"))
-
-    # This CLI shows complete error messages unlike the GUI's.
-    url = pastebin_manager.paste(
-        pastebin=pastebin,
-        content=content,
-        expiry=expiry,
-        syntax=args.syntax,
-        title=args.title,
-        username=args.username,
-    )
+    except Exception as e:
+        # Standard input can't be read again, but files can.
+        ticket = None
+        if filenames:
+            ticket = _queue_failed(filenames[0], e, {
+                'pastebin': pastebin, 'expiry': expiry, 'syntax': syntax,
+                'title': args.title, 'username': args.username})
+        if ticket is not None:
+            from qastetray.core import paste_queue
+            paste_queue.start_worker()
+            error(_("{}, the paste was queued as {}").format(e, ticket))
+        if isinstance(e, (pastebin_manager.PasteTimeout,
+                          paste_daemon.DaemonError)):
+            error(str(e))
+        raise
+    recent_paste_manager.recent_pastes.add(url, args.title, pastebin.name)
     print(url)
 
     sys.exit()
@@ -23,8 +23,6 @@
 
 import gettext
 import os
-from urllib.request import pathname2url
-import webbrowser
 
 from qastetray.core import filepaths
 
@@ -37,6 +35,11 @@ def load_gettext():
 
 def help():
     """Display the help HTML page in a web browser."""
+    # These are imported here because importing them is slow and most
+    # programs that use QasteTray never show the help.
+    from urllib.request import pathname2url
+    import webbrowser
+
     path = os.path.join(filepaths.docdir, 'index.html')
     url = 'file://' + pathname2url(path)
 
@@ -19,56 +19,105 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-"""The filepaths."""
+"""The filepaths.
+
+Importing this module doesn't touch the filesystem. The paths are
+computed when they are used for the first time, and the user-wide
+directories are created by make_dirs() before writing files to them.
+"""
 
 import configparser
 import os
 import platform
 import site
 
+from qastetray import profiling
 
-# This is where QasteTray is installed, and default pastebins are here.
-def _get_dir(name):
-    """Get a directory."""
-    result = _dirconfig['InstallDirs'][name]
-    result = os.path.join(topdir, result)
-    return os.path.abspath(result)
 
+# This is where QasteTray is installed, and default pastebins are here.
 topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-_dirconfig = configparser.ConfigParser(
-    dict_type=dict,
-    interpolation=configparser.ExtendedInterpolation(),
-)
-_dirconfig.read([os.path.join(topdir, 'dirs.conf')])
-_dirconfig['InstallDirs']['pardir'] = os.path.pardir
-_dirconfig['InstallDirs']['sep'] = os.path.sep
-docdir = _get_dir('doc')
-icondir = _get_dir('icons')
-localedir = _get_dir('locale')
-
-
-# User-wide pastebins will be here.
-usersitedir = site.getusersitepackages()
-site.addsitedir(usersitedir)
-usersitedir = os.path.join(usersitedir, 'qastetray')
-
-# Settings will be in user_config and temporary files in user_cache.
-if 'APPDATA' in os.environ and 'TEMP' in os.environ:
-    # Windows.
-    usercachedir = os.path.join(os.getenv('TEMP'), 'QasteTray')
-    userconfigdir = os.path.join(os.getenv('APPDATA'), 'QasteTray')
-elif platform.system() == 'Darwin':
-    # Mac OSX.
-    usercachedir = os.path.expanduser('~/Library/Caches/QasteTray')
-    userconfigdir = os.path.expanduser(
-        '~/Library/Application Support/QasteTray')
-else:
-    # Probably other UNIX-like. /tmp cannot be used because these must
-    # be user-specific.
-    usercachedir = os.path.expanduser('~/.cache/qastetray')
-    userconfigdir = os.path.expanduser('~/.config/qastetray')
-
-os.makedirs(usersitedir, exist_ok=True)
-os.makedirs(usercachedir, exist_ok=True)
-os.makedirs(userconfigdir, exist_ok=True)
+_user_site_added = False
+
+
+def _get_install_dirs():
+    """Read the directories in dirs.conf."""
+    dirconfig = configparser.ConfigParser(
+        dict_type=dict,
+        interpolation=configparser.ExtendedInterpolation(),
+    )
+    dirconfig.read([os.path.join(topdir, 'dirs.conf')])
+    dirconfig['InstallDirs']['pardir'] = os.path.pardir
+    dirconfig['InstallDirs']['sep'] = os.path.sep
+
+    result = {}
+    for attribute, name in [('docdir', 'doc'), ('icondir', 'icons'),
+                            ('localedir', 'locale')]:
+        path = os.path.join(topdir, dirconfig['InstallDirs'][name])
+        result[attribute] = os.path.abspath(path)
+    return result
+
+
+def _get_user_dirs():
+    """Return the user-wide directories."""
+    # User-wide pastebins will be here.
+    usersitedir = os.path.join(site.getusersitepackages(), 'qastetray')
+
+    # Settings will be in user_config and temporary files in user_cache.
+    if 'APPDATA' in os.environ and 'TEMP' in os.environ:
+        # Windows.
+        usercachedir = os.path.join(os.getenv('TEMP'), 'QasteTray')
+        userconfigdir = os.path.join(os.getenv('APPDATA'), 'QasteTray')
+    elif platform.system() == 'Darwin':
+        # Mac OSX.
+        usercachedir = os.path.expanduser('~/Library/Caches/QasteTray')
+        userconfigdir = os.path.expanduser(
+            '~/Library/Application Support/QasteTray')
+    else:
+        # Probably other UNIX-like. /tmp cannot be used because these
+        # must be user-specific.
+        usercachedir = os.path.expanduser('~/.cache/qastetray')
+        userconfigdir = os.path.expanduser('~/.config/qastetray')
+
+    return {'usersitedir': usersitedir, 'usercachedir': usercachedir,
+            'userconfigdir': userconfigdir}
+
+
+_getters = {
+    'docdir': _get_install_dirs,
+    'icondir': _get_install_dirs,
+    'localedir': _get_install_dirs,
+    'usersitedir': _get_user_dirs,
+    'usercachedir': _get_user_dirs,
+    'userconfigdir': _get_user_dirs,
+}
+
+
+def __getattr__(name):
+    """Compute a path when it's accessed for the first time."""
+    try:
+        getter = _getters[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}"
+                             .format(__name__, name)) from None
+    # The values are added to the module's globals, so this function
+    # is not called again for them.
+    with profiling.phase("filepaths." + getter.__name__):
+        globals().update(getter())
+    return globals()[name]
+
+
+def make_dirs(path):
+    """Create the directory that path is in if it doesn't exist."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+
+def add_user_site():
+    """Make user-wide pastebins importable.
+
+    This does nothing if it has been called already.
+    """
+    global _user_site_added
+    if not _user_site_added:
+        site.addsitedir(site.getusersitepackages())
+        _user_site_added = True
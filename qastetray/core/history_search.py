@@ -0,0 +1,193 @@
+# Copyright (c) 2016 Akuli
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Search the recent paste history.
+
+The history is indexed in an SQLite database in the cache directory.
+Every word in the titles, URLs and pastebin names is stored in a table
+with an index, so searching for words and their prefixes is fast even
+with hundreds of thousands of recent pastes. The database is updated
+from the recent paste journal before searching, and only the pastes
+added since the previous update are read. The whole index is rebuilt
+if the journal has been compacted.
+
+The search queries are words separated by spaces. A paste matches if it
+contains words that start with all words of the query. These filters
+can be used in the query too:
+
+    pastebin:NAME    pastes made with the pastebin (e.g. pastebin:dpaste)
+    on:YYYY-MM-DD    pastes made on the day
+    after:YYYY-MM-DD   pastes made on the day or later
+    before:YYYY-MM-DD  pastes made before the day
+"""
+
+import datetime
+import os
+import re
+import sqlite3
+import threading
+
+from qastetray.core import filepaths, recent_paste_manager
+
+
+_DATABASE = os.path.join(filepaths.usercachedir, 'history-index.sqlite3')
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pastes (
+    id INTEGER PRIMARY KEY,
+    url TEXT,
+    title TEXT,
+    pastebin TEXT,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS pastes_time ON pastes (time);
+CREATE TABLE IF NOT EXISTS words (
+    word TEXT,
+    paste INTEGER
+);
+CREATE INDEX IF NOT EXISTS words_word ON words (word);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value
+);
+'''
+
+_lock = threading.Lock()
+
+
+def _split_words(text):
+    """Return a set of lowercase words in text."""
+    return set(re.findall(r'\w+', text.lower()))
+
+
+def _get_state(connection, key, default):
+    row = connection.execute(
+        'SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+    return default if row is None else row[0]
+
+
+def _set_state(connection, key, value):
+    connection.execute(
+        'INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+        (key, value))
+
+
+def _first_line():
+    """Return the first line of the journal or None."""
+    try:
+        with open(recent_paste_manager.JOURNAL_FILE, 'rb') as f:
+            return f.readline().decode('utf-8', errors='replace')
+    except FileNotFoundError:
+        return None
+
+
+def _update(connection):
+    """Add pastes from the journal to the index."""
+    offset = _get_state(connection, 'offset', 0)
+    first_line = _first_line()
+    try:
+        size = os.path.getsize(recent_paste_manager.JOURNAL_FILE)
+    except OSError:
+        size = 0
+
+    # Compacting the journal removes pastes from its beginning.
+    if (size < offset or
+            _get_state(connection, 'first_line', None) != first_line):
+        connection.execute('DELETE FROM pastes')
+        connection.execute('DELETE FROM words')
+        offset = 0
+    elif size == offset:
+        return
+
+    for paste, offset in recent_paste_manager.read_journal(offset):
+        cursor = connection.execute(
+            'INSERT INTO pastes (url, title, pastebin, time) '
+            'VALUES (?, ?, ?, ?)',
+            (paste.url, paste.title, paste.pastebin, paste.time))
+        words = (_split_words(paste.url) | _split_words(paste.title) |
+                 _split_words(paste.pastebin))
+        connection.executemany(
+            'INSERT INTO words (word, paste) VALUES (?, ?)',
+            [(word, cursor.lastrowid) for word in words])
+
+    _set_state(connection, 'offset', offset)
+    _set_state(connection, 'first_line', first_line)
+
+
+def _parse_date(text):
+    """Return a timestamp of the beginning of a YYYY-MM-DD day."""
+    try:
+        date = datetime.datetime.strptime(text, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError("invalid date {!r}, should be YYYY-MM-DD"
+                         .format(text)) from None
+    return date.timestamp()
+
+
+def search(query, limit=20):
+    """Search the recent pastes.
+
+    Return a list of recent_paste_manager.RecentPaste named tuples,
+    newest first. ValueError is raised if the query has an invalid
+    filter.
+    """
+    conditions = []
+    parameters = []
+    for part in query.split():
+        key, colon, value = part.partition(':')
+        if colon and key == 'pastebin':
+            conditions.append('lower(pastebin) = ?')
+            parameters.append(value.lower())
+        elif colon and key in {'on', 'after', 'before'}:
+            start = _parse_date(value)
+            if key in {'on', 'after'}:
+                conditions.append('time >= ?')
+                parameters.append(start)
+            if key == 'on':
+                conditions.append('time < ?')
+                parameters.append(start + 24*60*60)
+            if key == 'before':
+                conditions.append('time < ?')
+                parameters.append(start)
+        else:
+            for word in _split_words(part):
+                # All words that start with word are between it and the
+                # word with a huge character added to it.
+                conditions.append('id IN (SELECT paste FROM words '
+                                  'WHERE word >= ? AND word < ?)')
+                parameters.extend([word, word + '\U0010ffff'])
+
+    sql = 'SELECT url, title, pastebin, time FROM pastes'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY time DESC, id DESC LIMIT ?'
+    parameters.append(limit)
+
+    with _lock:
+        filepaths.make_dirs(_DATABASE)
+        connection = sqlite3.connect(_DATABASE, timeout=10)
+        try:
+            with connection:
+                connection.executescript(_SCHEMA)
+                _update(connection)
+            rows = connection.execute(sql, parameters).fetchall()
+        finally:
+            connection.close()
+    return [recent_paste_manager.RecentPaste._make(row) for row in rows]
@@ -22,7 +22,9 @@
 """A cross-platform file locker for QasteTray.
 
 Use the locked context manager in a main function. It will raise
-IsLocked if the lockfile has been locked by another process.
+IsLocked if the lockfile has been locked by another process. Other
+lockfiles can be given for things that only one process should do at a
+time.
 """
 
 import contextlib
@@ -40,9 +42,10 @@ class IsLocked(OSError):
 
 
 @contextlib.contextmanager
-def _windows_locked():
+def _windows_locked(lockfile=_LOCKFILE):
     """Locking context manager for Windows."""
-    with open(_LOCKFILE, 'w') as f:
+    filepaths.make_dirs(lockfile)
+    with open(lockfile, 'w') as f:
         try:
             # The lockfile needs to contain something to lock.
             content = "This is a QasteTray lock file."
@@ -56,9 +59,10 @@ def _windows_locked():
 
 
 @contextlib.contextmanager
-def _unix_locked():
+def _unix_locked(lockfile=_LOCKFILE):
     """Locking context manager for Unix-like operating systems."""
-    with open(_LOCKFILE, 'w') as f:
+    filepaths.make_dirs(lockfile)
+    with open(lockfile, 'w') as f:
         try:
             fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
         except OSError as e:
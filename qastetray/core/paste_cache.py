@@ -0,0 +1,213 @@
+# Copyright (c) 2016 Akuli
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""A cache of pastes that have already been made.
+
+Pasting the same content again with the same pastebin and arguments
+returns the URL of the old paste instead of pasting again, as long as
+the old paste hasn't expired. The cache is a JSON file in the cache
+directory. Its keys are SHA-256 hashes of the pastebin name, the
+content, the expiry, the syntax and the title, so the content itself is
+never stored.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from qastetray.core import filepaths, setting_manager
+
+
+_CACHE_FILE = os.path.join(filepaths.usercachedir, 'paste-cache.json')
+
+# A cached paste is not used if it would expire in less than this many
+# seconds, because the user needs some time to share the URL.
+_EXPIRY_MARGIN = 60 * 60
+
+_settings = setting_manager.get('core.conf')['PasteCache']
+_lock = threading.Lock()
+
+# This is loaded from _CACHE_FILE when it's needed. The keys are hashes
+# and the values are [url, expiry_time, last_used_time] lists.
+# expiry_time is None for pastes that never expire.
+_entries = None
+
+
+def _hash_content(content, sha):
+    """Add the content to a hashlib object.
+
+    Return False if the content can't be hashed without consuming it.
+    """
+    chunk_size = 64 * 1024
+    if isinstance(content, str):
+        # The content is encoded in chunks to avoid copying all of it.
+        for start in range(0, len(content), chunk_size):
+            sha.update(content[start:start+chunk_size].encode('utf-8'))
+        return True
+
+    # Files can be hashed if they can be rewinded after hashing.
+    try:
+        position = content.tell()
+        while True:
+            chunk = content.read(chunk_size)
+            if not chunk:
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            sha.update(chunk)
+        content.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return False
+    return True
+
+
+def get_key(pastebin, content, expiry, syntax, title):
+    """Return a cache key for a paste.
+
+    None is returned if the cache is disabled in core.conf or the
+    content is a file object that can't be rewinded, like a pipe.
+    """
+    if not _settings.getboolean('enabled'):
+        return None
+
+    sha = hashlib.sha256()
+    sha.update(json.dumps([pastebin.name, expiry, syntax, title or ''])
+               .encode('utf-8'))
+    sha.update(b'\0')
+    if not _hash_content(content, sha):
+        return None
+    return sha.hexdigest()
+
+
+def _load():
+    """Load the cache file if it hasn't been loaded yet."""
+    global _entries
+    if _entries is not None:
+        return
+    try:
+        with open(_CACHE_FILE, 'r', encoding='utf-8') as f:
+            _entries = json.load(f)
+    except (OSError, ValueError):
+        _entries = {}
+    if not isinstance(_entries, dict):
+        _entries = {}
+
+
+def _evict(now):
+    """Remove expired entries and least recently used entries.
+
+    No more than maxlen entries are left.
+    """
+    for key, (url, expiry_time, last_used) in list(_entries.items()):
+        if expiry_time is not None and expiry_time - _EXPIRY_MARGIN < now:
+            del _entries[key]
+
+    maxlen = _settings.getint('maxlen')
+    if len(_entries) > maxlen:
+        by_last_use = sorted(_entries, key=lambda key: _entries[key][2])
+        for key in by_last_use[:len(_entries) - maxlen]:
+            del _entries[key]
+
+
+def _save():
+    """Write the cache to the cache file.
+
+    Other QasteTray processes may have added entries to the file after
+    it was loaded, so the entries in the file are merged with the
+    entries in memory before writing. The most recently used one of two
+    entries with the same key is kept.
+    """
+    try:
+        with open(_CACHE_FILE, 'r', encoding='utf-8') as f:
+            on_disk = json.load(f)
+    except (OSError, ValueError):
+        on_disk = {}
+    if isinstance(on_disk, dict):
+        for key, entry in on_disk.items():
+            if not (isinstance(entry, list) and len(entry) == 3):
+                continue
+            if key not in _entries or _entries[key][2] < entry[2]:
+                _entries[key] = entry
+    _evict(time.time())
+
+    filepaths.make_dirs(_CACHE_FILE)
+    temppath = '{}.{}.tmp'.format(_CACHE_FILE, os.getpid())
+    with open(temppath, 'w', encoding='utf-8') as f:
+        json.dump(_entries, f)
+    os.replace(temppath, _CACHE_FILE)
+
+
+def _try_save():
+    try:
+        _save()
+    except OSError:
+        # The cache works in memory without the file.
+        pass
+
+
+def get(key):
+    """Return the URL of a cached paste or None if it's not cached."""
+    now = time.time()
+    with _lock:
+        _load()
+        try:
+            url, expiry_time, last_used = _entries[key]
+        except KeyError:
+            return None
+        if expiry_time is not None and expiry_time - _EXPIRY_MARGIN < now:
+            del _entries[key]
+            return None
+        # The last use time is saved for evicting the least recently
+        # used entries in all processes.
+        _entries[key][2] = now
+        _try_save()
+        return url
+
+
+def add(key, url, expiry_days):
+    """Add a paste to the cache.
+
+    expiry_days should be negative if the paste never expires.
+    """
+    now = time.time()
+    if expiry_days < 0:
+        expiry_time = None
+    else:
+        expiry_time = now + expiry_days * 24 * 60 * 60
+
+    with _lock:
+        _load()
+        _entries[key] = [url, expiry_time, now]
+        _evict(now)
+        _try_save()
+
+
+def clear():
+    """Remove all cached pastes."""
+    global _entries
+    with _lock:
+        _entries = {}
+        try:
+            os.remove(_CACHE_FILE)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,254 @@
+# Copyright (c) 2016 Akuli
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""A background process that pastes for qastetray-cli.
+
+Starting Python, importing requests and the pastebins and connecting to
+the pastebin take much longer than a small paste itself. serve() keeps
+everything loaded and the connections open, and paste() sends pastes to
+it over a Unix socket in the cache directory. Only one daemon can run at
+a time.
+
+The protocol is simple. The client sends a JSON object on one line and
+then the content, and it shuts down the sending side of the connection
+when the content has been sent. The daemon responds with a JSON object
+on one line.
+"""
+
+import json
+import os
+import socket
+import time
+
+from qastetray.core import filepaths, lock
+
+
+SOCKET_FILE = os.path.join(filepaths.usercachedir, 'daemon.sock')
+_LOCKFILE = os.path.join(filepaths.usercachedir, 'daemon.lock')
+
+# The header line can't be longer than this.
+_MAX_HEADER_SIZE = 64 * 1024
+
+# The client waits this many seconds more than the paste's deadline
+# before giving up on the daemon.
+_RESPONSE_MARGIN = 5
+
+
+class NotRunning(OSError):
+    """The daemon is not running.
+
+    Nothing has been sent to the daemon when this is raised, so the
+    paste can be done without the daemon instead.
+    """
+
+
+class DaemonError(Exception):
+    """Pasting with the daemon failed."""
+
+
+def _connect():
+    """Connect to the daemon or raise NotRunning."""
+    if not hasattr(socket, 'AF_UNIX'):
+        raise NotRunning("Unix sockets are not supported")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_FILE)
+    except OSError as e:
+        sock.close()
+        raise NotRunning("the daemon is not running") from e
+    return sock
+
+
+def _request(header, content=b'', timeout=None):
+    """Send a request to the daemon and return its response."""
+    with _connect() as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.sendall(json.dumps(header).encode('utf-8') + b'\n')
+            if isinstance(content, (str, bytes)):
+                if content:
+                    sock.sendall(content.encode('utf-8')
+                                 if isinstance(content, str) else content)
+            else:
+                # The daemon can start pasting before everything is read.
+                read = getattr(content, 'read1', content.read)
+                chunk = read(64 * 1024)
+                while chunk:
+                    sock.sendall(chunk.encode('utf-8')
+                                 if isinstance(chunk, str) else chunk)
+                    chunk = read(64 * 1024)
+            sock.shutdown(socket.SHUT_WR)
+        except (BrokenPipeError, ConnectionResetError):
+            # The daemon responds without reading everything if the
+            # request is invalid, and the response tells what happened.
+            pass
+
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    try:
+        return json.loads(line.decode('utf-8'))
+    except ValueError:
+        raise DaemonError("the daemon stopped unexpectedly") from None
+
+
+def paste(pastebin, content, expiry, syntax, title, username,
+          deadline=None):
+    """Paste with the daemon.
+
+    The arguments are like pastebin_manager.paste()'s arguments, but
+    the content can also be bytes. Return the URL. NotRunning is raised
+    if the daemon is not running. Errors from the daemon are raised as
+    UnicodeError, pastebin_manager.PasteTimeout or DaemonError.
+    """
+    from qastetray.core import pastebin_manager, setting_manager
+    if deadline is None:
+        timeout = setting_manager.get('core.conf')['Connections'].getfloat(
+            'timeout')
+    else:
+        timeout = max(0, deadline - time.monotonic())
+
+    response = _request({
+        'command': 'paste',
+        'pastebin': pastebin.name,
+        'expiry': expiry,
+        'syntax': syntax,
+        'title': title,
+        'username': username,
+        'timeout': timeout,
+    }, content, timeout + _RESPONSE_MARGIN)
+
+    if 'url' in response:
+        return response['url']
+    if response.get('type') in {'UnicodeError', 'UnicodeDecodeError'}:
+        raise UnicodeError(response['error'])
+    if response.get('type') == 'PasteTimeout':
+        raise pastebin_manager.PasteTimeout(response['error'])
+    raise DaemonError(response.get('error', "unknown error"))
+
+
+def get_pid():
+    """Return the process ID of the daemon or None if it's not running."""
+    try:
+        return _request({'command': 'status'}, timeout=_RESPONSE_MARGIN)['pid']
+    except (NotRunning, DaemonError, KeyError, OSError):
+        return None
+
+
+def stop():
+    """Stop the daemon. Return False if it's not running."""
+    try:
+        _request({'command': 'stop'}, timeout=_RESPONSE_MARGIN)
+    except NotRunning:
+        return False
+    return True
+
+
+def _handle(server, rfile):
+    """Handle a request and return the response."""
+    # pastebin_manager is imported when it's needed, so paste() doesn't
+    # import it unless the daemon is running.
+    from qastetray.core import pastebin_manager, setting_manager
+
+    try:
+        header = json.loads(rfile.readline(_MAX_HEADER_SIZE).decode('utf-8'))
+        command = header['command']
+    except (ValueError, TypeError, KeyError):
+        return {'error': "invalid request", 'type': 'ValueError'}
+
+    if command == 'status':
+        return {'pid': os.getpid()}
+    if command == 'stop':
+        # shutdown() waits until serve_forever() returns, and this
+        # thread must not wait for itself.
+        server.stopping = True
+        return {'pid': os.getpid()}
+    if command != 'paste':
+        return {'error': "unknown command {!r}".format(command),
+                'type': 'ValueError'}
+
+    # The user may have changed the settings after starting the daemon.
+    setting_manager.check_changes()
+    try:
+        pastebin = pastebin_manager.pastebins[header['pastebin']]
+        url = pastebin_manager.paste(
+            pastebin, rfile, header['expiry'], header['syntax'],
+            header['title'], header['username'],
+            time.monotonic() + header['timeout'])
+    except Exception as e:
+        return {'error': '{}: {}'.format(type(e).__name__, e),
+                'type': type(e).__name__}
+    return {'url': url}
+
+
+def serve():
+    """Run the daemon until stop() is called.
+
+    lock.IsLocked is raised if the daemon is already running.
+    """
+    # These are not needed for pasting with the daemon.
+    import socketserver
+    import threading
+    from qastetray.core import pastebin_manager
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            response = _handle(self.server, self.rfile)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            if self.server.stopping:
+                threading.Thread(target=self.server.shutdown).start()
+
+    class Server(socketserver.ThreadingMixIn,
+                 socketserver.UnixStreamServer):
+        daemon_threads = True
+        stopping = False
+
+    with lock.locked(_LOCKFILE):
+        pastebin_manager.load()
+        for pastebin in pastebin_manager.pastebins.values():
+            # This imports the pastebin's module if it's not imported
+            # yet, so the first paste doesn't need to import it.
+            pastebin.paste
+        # Importing requests is the slowest part of pasting in a new
+        # process.
+        import requests     # NOQA
+
+        # The lock is held, so an old socket file is not used by any
+        # other daemon anymore.
+        try:
+            os.remove(SOCKET_FILE)
+        except FileNotFoundError:
+            pass
+        filepaths.make_dirs(SOCKET_FILE)
+        old_umask = os.umask(0o077)
+        try:
+            server = Server(SOCKET_FILE, Handler)
+        finally:
+            os.umask(old_umask)
+
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            try:
+                os.remove(SOCKET_FILE)
+            except FileNotFoundError:
+                pass
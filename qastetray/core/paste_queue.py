@@ -0,0 +1,287 @@
+# Copyright (c) 2016 Akuli
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""A queue of pastes that are pasted later.
+
+Each queued paste has a ticket, and the ticket's information and the
+content are stored in files in the paste-queue directory in the cache
+directory, so queued pastes survive restarts. drain() pastes the queued
+pastes, and a paste that fails is tried again later with an increasing
+delay. Pasted pastes are added to the recent pastes.
+
+Only one process drains the queue at a time, and start_worker() starts
+a background process for draining it.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+from qastetray.core import (filepaths, lock, pastebin_manager,
+                            recent_paste_manager, setting_manager)
+
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+_QUEUE_DIR = os.path.join(filepaths.usercachedir, 'paste-queue')
+_DRAIN_LOCKFILE = os.path.join(_QUEUE_DIR, 'drain.lock')
+
+# drain() checks for new pastes this often while it's waiting for the
+# next retry, in seconds.
+_POLL_INTERVAL = 5
+
+_settings = setting_manager.get('core.conf')['PasteQueue']
+
+
+def _get_paths(ticket):
+    """Return the information and content file paths of a ticket."""
+    base = os.path.join(_QUEUE_DIR, ticket)
+    return base + '.json', base + '.content'
+
+
+def _write_entry(entry):
+    """Save the information about a ticket."""
+    path = _get_paths(entry['ticket'])[0]
+    filepaths.make_dirs(path)
+    temppath = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temppath, 'w', encoding='utf-8') as f:
+        json.dump(entry, f)
+    os.replace(temppath, path)
+
+
+def get(ticket):
+    """Return a dictionary of information about a ticket or None.
+
+    The dictionary has these keys:
+
+      ticket        the ticket ID
+      state         PENDING, DONE or FAILED
+      pastebin      name of the pastebin
+      expiry, syntax, title, username
+                    the arguments of pastebin_manager.paste()
+      created       time.time() when the paste was queued
+      attempts      number of failed attempts
+      next_attempt  time.time() when the paste is tried again
+      url           URL of the paste if it's DONE, otherwise None
+      error         the latest error message or None
+    """
+    try:
+        with open(_get_paths(ticket)[0], 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict):
+        return None
+    return entry
+
+
+def get_all():
+    """Return a list of all tickets' information, oldest first."""
+    try:
+        names = os.listdir(_QUEUE_DIR)
+    except FileNotFoundError:
+        return []
+    entries = [get(name[:-len('.json')])
+               for name in names if name.endswith('.json')]
+    return sorted((entry for entry in entries if entry is not None),
+                  key=lambda entry: entry['created'])
+
+
+def add(pastebin, content, expiry, syntax, title, username, error=None):
+    """Queue a paste and return its ticket ID.
+
+    The arguments are like pastebin_manager.paste()'s arguments. The
+    content can be a string or a file object, and it's copied to the
+    queue directory. If error is given, the paste is considered failed
+    once already.
+    """
+    ticket = uuid.uuid4().hex[:12]
+    content_path = _get_paths(ticket)[1]
+    filepaths.make_dirs(content_path)
+    with open(content_path, 'wb') as f:
+        if isinstance(content, str):
+            f.write(content.encode('utf-8'))
+        else:
+            data = content.read(64 * 1024)
+            while data:
+                f.write(data.encode('utf-8') if isinstance(data, str)
+                        else data)
+                data = content.read(64 * 1024)
+
+    now = time.time()
+    entry = {
+        'ticket': ticket,
+        'state': PENDING,
+        'pastebin': pastebin.name,
+        'expiry': expiry,
+        'syntax': syntax,
+        'title': title,
+        'username': username,
+        'created': now,
+        'attempts': 0,
+        'next_attempt': now,
+        'url': None,
+        'error': None,
+    }
+    if error is not None:
+        _record_failure(entry, error, now)
+    # The content is written first, so the ticket is never visible
+    # without it.
+    _write_entry(entry)
+    return ticket
+
+
+def _record_failure(entry, error, now):
+    """Update the entry after a failed attempt."""
+    entry['attempts'] += 1
+    entry['error'] = '{}: {}'.format(type(error).__name__, error)
+    if entry['attempts'] >= _settings.getint('max-attempts'):
+        entry['state'] = FAILED
+        return
+    delay = min(_settings.getfloat('retry-delay') *
+                2 ** (entry['attempts'] - 1),
+                _settings.getfloat('max-retry-delay'))
+    # Many queued pastes shouldn't be retried at the same time.
+    entry['next_attempt'] = now + random.uniform(delay / 2, delay)
+
+
+def _finish(entry, state):
+    """Mark the entry done or failed and remove the content file."""
+    entry['state'] = state
+    try:
+        os.remove(_get_paths(entry['ticket'])[1])
+    except FileNotFoundError:
+        pass
+
+
+def _attempt(entry):
+    """Try to paste a queued paste."""
+    try:
+        pastebin = pastebin_manager.pastebins[entry['pastebin']]
+    except KeyError:
+        entry['error'] = "unknown pastebin {!r}".format(entry['pastebin'])
+        _finish(entry, FAILED)
+        return
+
+    try:
+        with open(_get_paths(entry['ticket'])[1], 'rb') as f:
+            url = pastebin_manager.paste(
+                pastebin, f, entry['expiry'], entry['syntax'],
+                entry['title'], entry['username'])
+    except (UnicodeError, FileNotFoundError) as e:
+        # Trying again wouldn't help.
+        entry['error'] = '{}: {}'.format(type(e).__name__, e)
+        _finish(entry, FAILED)
+    except Exception as e:
+        _record_failure(entry, e, time.time())
+    else:
+        entry['url'] = url
+        entry['error'] = None
+        _finish(entry, DONE)
+        recent_paste_manager.recent_pastes.add(
+            url, entry['title'] or '', pastebin.name)
+
+
+def _remove(entry):
+    """Forget a ticket."""
+    for path in _get_paths(entry['ticket']):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def drain_once():
+    """Try to paste the queued pastes that should be tried now.
+
+    Return the number of seconds until the next paste should be tried,
+    or None if there are no pending pastes. Call pastebin_manager.load()
+    and recent_paste_manager.load() before calling this.
+    """
+    keep_seconds = _settings.getfloat('keep-days') * 24 * 60 * 60
+    next_attempt = None
+    for entry in get_all():
+        if entry['state'] != PENDING:
+            if entry['created'] + keep_seconds < time.time():
+                _remove(entry)
+            continue
+        if entry['next_attempt'] <= time.time():
+            _attempt(entry)
+            _write_entry(entry)
+        if entry['state'] == PENDING:
+            if next_attempt is None:
+                next_attempt = entry['next_attempt']
+            next_attempt = min(next_attempt, entry['next_attempt'])
+
+    if next_attempt is None:
+        return None
+    return max(0, next_attempt - time.time())
+
+
+def drain():
+    """Paste queued pastes until there are no pending pastes left.
+
+    Return False without doing anything if another process is already
+    draining the queue.
+    """
+    while True:
+        try:
+            with lock.locked(_DRAIN_LOCKFILE):
+                while True:
+                    delay = drain_once()
+                    if delay is None:
+                        break
+                    time.sleep(min(delay, _POLL_INTERVAL))
+        except lock.IsLocked:
+            return False
+
+        # A paste may have been queued after drain_once() checked the
+        # queue, and the process that queued it couldn't drain it
+        # because this process had the lock.
+        if not any(entry['state'] == PENDING for entry in get_all()):
+            return True
+
+
+def start_worker():
+    """Drain the queue in a new background process.
+
+    The new process exits right away if the queue is already being
+    drained, and when all pastes are done or failed.
+    """
+    # subprocess is not needed when pasting normally.
+    import subprocess
+
+    kwargs = {}
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = (subprocess.DETACHED_PROCESS |
+                                   subprocess.CREATE_NEW_PROCESS_GROUP)
+    else:
+        # The worker keeps running when the terminal is closed.
+        kwargs['start_new_session'] = True
+    subprocess.Popen(
+        [sys.executable, '-m', 'qastetray.cli', 'queue', 'drain'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, **kwargs)
@@ -29,21 +29,170 @@ pastebin_manager to avoid confusing it with qastetray.pastebins.
 Pasting with a pastebin is simple. Select a pastebin from the pastebins
 dictionary, and call its paste method with arguments defined in its
 paste_args.
+
+Importing pastebins can be slow, so load() doesn't import them if their
+name, url, expiry_days and paste_args are in an index file that is kept
+in the cache directory. The pastebin is imported when something else
+is needed from it, usually when pasting.
+
+The content can be a string or a file object. Pastebins that set
+content_stream to True get a ContentStream instead of a string, and they
+can start pasting before the whole content has been read. Pastebins can
+also set max_size to the biggest paste they accept in bytes of UTF-8,
+and bigger contents are split into many pastes with an index paste that
+links to them.
+
+paste_async() and paste_many_async() can be used for pasting from
+asyncio code. paste_hedged() pastes to many pastebins at once and
+returns the URL from the fastest one. Pastebins can define paste as a
+coroutine function, and regular paste functions are called in a thread
+pool. The time and result of each paste are recorded in pastebin_stats.
+
+Pastebins that use HTTP should get a requests.Session from get_session()
+instead of calling requests.post() directly. The sessions keep their
+connections alive, so pasting many times doesn't require a new TCP and
+TLS handshake for each paste.
+
+Every paste has a deadline, and pastes that don't finish before it fail
+with PasteTimeout. Pastebins that don't use get_session() should get
+their timeouts from get_timeout().
 """
 
+import codecs
+import contextvars
+import functools
 import importlib
+import inspect
+import io
+import itertools
+import json
+import operator
 import os
 import re
+import socket
+import string
 import sys
+import threading
+import time
+import urllib.parse
+
+from qastetray import USER_AGENT, profiling
+from qastetray.core import (filepaths, paste_cache, pastebin_stats,
+                            setting_manager, syntax_detect, syntax_index)
 
 
 pastebins = {}
 loaders = {}
 
+# These attributes are stored in the index, so they can be used without
+# loading the pastebin.
+_INDEXED_ATTRIBUTES = ['name', 'url', 'expiry_days', 'paste_args']
+_INDEX_FILE = os.path.join(filepaths.usercachedir, 'pastebin-index.json')
+
+_settings = setting_manager.get('core.conf')['Connections']
+_adapters = {}
+_session_class = None
+_sessions_lock = threading.Lock()
+_local = threading.local()
+
+_pasting_settings = setting_manager.get('core.conf')['Pasting']
+_executor = None
+_executor_size = 0
+_executor_lock = threading.Lock()
+_daemon_executor = None
+
+# The time.monotonic() time when the current paste must be done.
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class PasteTimeout(TimeoutError):
+    """Raised when a paste doesn't finish before its deadline."""
+
+
+class _LazyPastebin:
+    """A pastebin that is loaded when it's actually needed.
+
+    The indexed attributes are available without loading the pastebin,
+    and getting or setting other attributes loads it.
+    """
+
+    def __init__(self, loader, filepath, metadata):
+        """Initialize the lazy pastebin without loading it."""
+        self._loader = loader
+        self._filepath = filepath
+        self._metadata = metadata
+        self._pastebin = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Load the pastebin if it's not loaded yet and return it."""
+        with self._lock:
+            if self._pastebin is None:
+                with profiling.phase("load " + self._filepath):
+                    self._pastebin = self._loader(self._filepath)
+            return self._pastebin
+
+    def __getattr__(self, attribute):
+        """Implement self.attribute for attributes of the pastebin."""
+        # This is not called for the attributes set in __init__.
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+        try:
+            return self._metadata[attribute]
+        except KeyError:
+            return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        """Set an attribute of the pastebin."""
+        if attribute.startswith('_'):
+            super().__setattr__(attribute, value)
+        else:
+            setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        """Return a string representation of the lazy pastebin."""
+        return '<lazily loaded pastebin {!r} from {!r}>'.format(
+            self._metadata['name'], self._filepath)
+
+
+def _read_index():
+    """Read the pastebin index file.
+
+    An empty dictionary is returned if the index doesn't exist or it's
+    broken. It will be recreated by load().
+    """
+    try:
+        with open(_INDEX_FILE, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(index, dict):
+        return {}
+    return index
+
+
+def _write_index(index):
+    """Write the pastebin index file."""
+    # The index is written to a temporary file first, so another
+    # QasteTray process never reads a half-written index.
+    filepaths.make_dirs(_INDEX_FILE)
+    temppath = '{}.{}.tmp'.format(_INDEX_FILE, os.getpid())
+    with open(temppath, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(temppath, _INDEX_FILE)
+
 
 def load():
-    """Load the pastebins."""
+    """Load the pastebins.
+
+    Pastebins that are in the index and haven't been modified since
+    they were indexed are not actually loaded until they are needed.
+    """
+    filepaths.add_user_site()
     pastebins.clear()
+    old_index = _read_index()
+    new_index = {}
+
     for directory in sys.path:
         directory = os.path.join(directory, 'qastetray', 'pastebins')
         if not os.path.isdir(directory):
@@ -61,39 +210,833 @@ def load():
                 continue
 
             loader = loaders[extension]
-            filepath = os.path.join(directory, filename)
-            pastebin = loader(filepath)
+            filepath = os.path.abspath(os.path.join(directory, filename))
+            stat = os.stat(filepath)
+            entry = old_index.get(filepath)
+            if (isinstance(entry, dict) and
+                    entry.get('mtime') == stat.st_mtime_ns and
+                    entry.get('size') == stat.st_size):
+                pastebin = _LazyPastebin(loader, filepath, entry['metadata'])
+            else:
+                with profiling.phase("load " + filepath):
+                    pastebin = loader(filepath)
+                entry = {
+                    'mtime': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'metadata': {
+                        attribute: getattr(pastebin, attribute)
+                        for attribute in _INDEXED_ATTRIBUTES
+                    },
+                }
+            new_index[filepath] = entry
             pastebins[pastebin.name] = pastebin
 
+    if new_index != old_index:
+        try:
+            _write_index(new_index)
+        except OSError:
+            # The index is just a cache, so QasteTray works without it.
+            pass
 
-def paste(pastebin, content, expiry, syntax, title, username):
+
+def paste(pastebin, content, expiry, syntax, title, username,
+          deadline=None):
     """Paste with a pastebin.
 
     Arguments:
       pastebin: a pastebin from the pastebins dictionary
-      content:  the content to paste
+      content:  the content to paste as a string or a file object
       expiry:   expiry in days from pastebin.expiry_days
-      syntax:   a syntax choice
+      syntax:   a syntax choice or None
       title:    title of the paste or a falsy value
       username: nick, username or a falsy value
+      deadline: time.monotonic() time when the paste must be done, or
+                None to allow as many seconds as the timeout setting
+                in core.conf says
 
     If syntax_choice is a key from pastebin.syntax_choices, a value will
-    be used instead.
+    be used instead. If syntax is None, it's detected from the beginning
+    of the content if detect-syntax is enabled in core.conf, and
+    pastebin.syntax_default is used if that doesn't work.
+
+    If the same content has already been pasted with the same pastebin,
+    expiry, syntax and title and the paste hasn't expired yet, its URL
+    is returned from paste_cache without pasting again.
+
+    If the content is bigger than pastebin.max_size, it's split into
+    parts on line boundaries and the parts are pasted concurrently. Then
+    the URLs of the parts are pasted and the URL of that paste returned.
 
-    Return the URL of the newly created paste.
+    PasteTimeout is raised if the deadline passes while pasting. It's
+    also raised for timeouts in sockets and requests, so the pastebin
+    doesn't need to catch them.
+
+    Return the URL of the newly created paste. Pastebins with a coroutine
+    paste function are ran in a new event loop, so this raises
+    RuntimeError with them if an event loop is already running in this
+    thread. Use paste_async() in asyncio code.
     """
-    kwargs = {'content': content}
-    if 'expiry' in pastebin.paste_args:
-        kwargs['expiry'] = expiry
+    if deadline is None:
+        deadline = time.monotonic() + _settings.getfloat('timeout')
+    if inspect.iscoroutinefunction(pastebin.paste):
+        # asyncio is imported only when it's needed because importing
+        # it takes a long time compared to the rest of QasteTray.
+        import asyncio
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop is running in this thread, so we can start one.
+            return asyncio.run(_paste_coroutine(
+                pastebin, content, expiry, syntax, title, username,
+                deadline))
+        raise RuntimeError(
+            "cannot paste with {} from a running event loop, use "
+            "paste_async() instead".format(pastebin.name))
+
+    cache_key, url = _get_cached(pastebin, content, expiry, syntax, title)
+    if url is not None:
+        return url
+
+    if getattr(pastebin, 'max_size', None) is None:
+        url = _paste_blocking(pastebin, content, expiry, syntax, title,
+                              username, deadline)
+    else:
+        url = _paste_split(_paste_blocking, pastebin, content, expiry,
+                           syntax, title, username, deadline)
+    if cache_key is not None:
+        paste_cache.add(cache_key, url, _get_expiry_days(pastebin, expiry))
+    return url
+
+
+def _paste_blocking(pastebin, content, expiry, syntax, title, username,
+                    deadline):
+    """Call a blocking paste function without using the cache."""
+    kwargs = _get_kwargs(pastebin, content, expiry, syntax, title, username)
+    start = time.monotonic()
+    token = _deadline.set(deadline)
+    try:
+        url = pastebin.paste(**kwargs)
+    except UnicodeError:
+        # The content is bad, not the pastebin.
+        raise
+    except Exception as e:
+        error = _convert_timeout(pastebin, e)
+        pastebin_stats.record(pastebin.name, time.monotonic() - start, error)
+        if error is e:
+            raise
+        raise error from e
+    finally:
+        _deadline.reset(token)
+    pastebin_stats.record(pastebin.name, time.monotonic() - start)
+    return url
+
+
+async def _paste_coroutine(pastebin, content, expiry, syntax, title,
+                           username, deadline=None):
+    """Like paste(), but for pastebins with a coroutine paste function."""
+    import asyncio
+    if deadline is None:
+        deadline = time.monotonic() + _settings.getfloat('timeout')
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+
+    # Hashing and reading the content and writing the cache file would
+    # block the event loop, so they are done in the thread pool.
+    cache_key, url = await loop.run_in_executor(executor, functools.partial(
+        _get_cached, pastebin, content, expiry, syntax, title))
+    if url is not None:
+        return url
+
+    if getattr(pastebin, 'max_size', None) is None:
+        url = await _paste_awaiting(pastebin, content, expiry, syntax, title,
+                                    username, deadline)
+    else:
+        def paste_part(*args):
+            # The parts are pasted in threads, and each thread needs an
+            # event loop of its own.
+            return asyncio.run(_paste_awaiting(*args))
+
+        url = await loop.run_in_executor(executor, functools.partial(
+            _paste_split, paste_part, pastebin, content, expiry, syntax,
+            title, username, deadline))
+    if cache_key is not None:
+        await loop.run_in_executor(executor, functools.partial(
+            paste_cache.add, cache_key, url,
+            _get_expiry_days(pastebin, expiry)))
+    return url
+
+
+async def _paste_awaiting(pastebin, content, expiry, syntax, title, username,
+                          deadline):
+    """Await a coroutine paste function without using the cache."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    kwargs = await loop.run_in_executor(executor, functools.partial(
+        _get_kwargs, pastebin, content, expiry, syntax, title, username))
+    start = time.monotonic()
+    # This task has its own copy of the context, so this doesn't affect
+    # other pastes.
+    _deadline.set(deadline)
+    try:
+        url = await asyncio.wait_for(pastebin.paste(**kwargs),
+                                     max(0, deadline - time.monotonic()))
+    except (UnicodeError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        error = _convert_timeout(pastebin, e)
+        await loop.run_in_executor(executor, functools.partial(
+            pastebin_stats.record, pastebin.name, time.monotonic() - start,
+            error))
+        if error is e:
+            raise
+        raise error from e
+    await loop.run_in_executor(executor, functools.partial(
+        pastebin_stats.record, pastebin.name, time.monotonic() - start))
+    return url
+
+
+def _split_content(content, max_size):
+    """Yield the content as strings of at most max_size bytes of UTF-8.
+
+    The parts end at line boundaries, and lines longer than max_size are
+    split between characters. At least one part is always yielded.
+    """
+    if isinstance(content, str):
+        lines = (line.encode('utf-8') for line in io.StringIO(content))
+    elif isinstance(content, io.TextIOBase):
+        lines = (line.encode('utf-8') for line in content)
+    else:
+        # UTF-8 never has b'\n' inside other characters, so binary files
+        # can be split on their own lines too.
+        lines = content
+
+    part = bytearray()
+    empty = True
+    for line in lines:
+        while len(line) > max_size:
+            if part:
+                yield part.decode('utf-8')
+                part = bytearray()
+            # Bytes that start with 0b10 continue a character.
+            end = max_size
+            while end > 0 and line[end] & 0xc0 == 0x80:
+                end -= 1
+            end = end or max_size
+            yield line[:end].decode('utf-8')
+            empty = False
+            line = line[end:]
+        if len(part) + len(line) > max_size:
+            yield part.decode('utf-8')
+            empty = False
+            part = bytearray()
+        part += line
+
+    if part or empty:
+        yield part.decode('utf-8')
+
+
+def _paste_split(paste_part, pastebin, content, expiry, syntax, title,
+                 username, deadline):
+    """Paste content that may be bigger than pastebin.max_size.
+
+    paste_part is called like _paste_blocking() for each part and for
+    the index paste. The parts are read from the content while pasting,
+    so only a few of them are in memory at the same time.
+    """
+    import concurrent.futures
+
+    if (syntax is None and 'syntax' in pastebin.paste_args and
+            _pasting_settings.getboolean('detect-syntax')):
+        # All parts should have the same syntax, and the end of a log
+        # file doesn't necessarily look like the beginning.
+        syntax = _detect_syntax(pastebin, content)
+
+    parts = _split_content(content, pastebin.max_size)
+    first = next(parts)
+    second = next(parts, None)
+    if second is None:
+        return paste_part(pastebin, first, expiry, syntax, title, username,
+                          deadline)
+
+    limit = _pasting_settings.getint('concurrency')
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=limit, thread_name_prefix='qastetray-part') as pool:
+        try:
+            for number, part in enumerate(
+                    itertools.chain([first, second], parts), start=1):
+                running = [future for future in futures
+                           if not future.done()]
+                if len(running) >= limit:
+                    concurrent.futures.wait(
+                        running,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in futures:
+                    # The other parts are useless if one part failed.
+                    if future.done() and future.exception() is not None:
+                        raise future.exception()
+
+                if title:
+                    part_title = '{} (part {})'.format(title, number)
+                else:
+                    part_title = 'Part {}'.format(number)
+                futures.append(pool.submit(
+                    paste_part, pastebin, part, expiry, syntax, part_title,
+                    username, deadline))
+            urls = [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    index = ['{} was too big for {}, so it was split into {} parts:'
+             .format(title or "This paste", pastebin.name, len(urls)), '']
+    index.extend(urls)
+    return paste_part(pastebin, '\n'.join(index) + '\n', expiry,
+                      getattr(pastebin, 'syntax_default', None), title,
+                      username, deadline)
+
+
+def get_timeout():
+    """Return a (connect_timeout, read_timeout) tuple for the current paste.
+
+    The timeouts are in seconds, and they are never longer than the time
+    that is left before the deadline of the paste. Pastebins can call
+    this again before each blocking operation to keep the whole paste
+    within the deadline. PasteTimeout is raised if the deadline has
+    already passed.
+
+    Outside paste functions, the timeouts come from core.conf.
+    """
+    connect_timeout = _settings.getfloat('connect-timeout')
+    deadline = _deadline.get()
+    if deadline is None:
+        return (connect_timeout, _settings.getfloat('timeout'))
+
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise PasteTimeout("the paste took too long")
+    return (min(connect_timeout, left), left)
+
+
+def _convert_timeout(pastebin, error):
+    """Return a PasteTimeout if error is a timeout, otherwise error."""
+    timeouts = (TimeoutError, socket.timeout)
+    # These modules are not imported here if nothing has imported them
+    # yet, and then the error can't be one of their exceptions.
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is not None:
+        timeouts += (asyncio.TimeoutError,)
+    requests = sys.modules.get('requests')
+    if requests is not None:
+        timeouts += (requests.Timeout,)
+    if isinstance(error, PasteTimeout) or not isinstance(error, timeouts):
+        return error
+    return PasteTimeout("{} didn't respond in time".format(pastebin.name))
+
+
+def _get_cached(pastebin, content, expiry, syntax, title):
+    """Look up a paste from paste_cache.
+
+    Return a (cache_key, url) pair. The cache_key is None if the paste
+    can't be cached and the url is None if it isn't in the cache.
+    """
+    cache_key = paste_cache.get_key(pastebin, content, expiry, syntax, title)
+    if cache_key is None:
+        return None, None
+    return cache_key, paste_cache.get(cache_key)
+
+
+def _get_expiry_days(pastebin, expiry):
+    """Return the number of days the paste will exist for."""
+    if 'expiry' in pastebin.paste_args and expiry is not None:
+        return expiry
+    # The pastebin doesn't let us choose, so this is its only expiry.
+    return pastebin.expiry_days[0]
+
+
+class ContentStream:
+    """Paste content that is read in chunks.
+
+    Iterating over a ContentStream gives the content as UTF-8 encoded
+    bytes objects, and the content is read from its file while iterating.
+    Only one chunk needs to be in memory at a time, so this works with
+    huge pastes too. A ContentStream can be iterated over only once.
+
+    If the content is read from a binary file, the file is available as
+    the file attribute. Otherwise the file attribute is None.
+    """
+
+    def __init__(self, content, chunk_size=64*1024):
+        """Initialize the stream.
+
+        The content can be a string or a text or binary file object.
+        """
+        self._content = content
+        self._chunk_size = chunk_size
+        if isinstance(content, (str, io.TextIOBase)):
+            self.file = None
+        else:
+            self.file = content
+
+    def __iter__(self):
+        """Yield the content in UTF-8 encoded chunks."""
+        if isinstance(self._content, str):
+            for start in range(0, len(self._content), self._chunk_size):
+                end = start + self._chunk_size
+                yield self._content[start:end].encode('utf-8')
+
+        elif self.file is None:
+            # A text file.
+            while True:
+                chunk = self._content.read(self._chunk_size)
+                if not chunk:
+                    break
+                yield chunk.encode('utf-8')
+
+        else:
+            # read1() returns as soon as some data is available, so the
+            # pasting can start before a pipe has been fully written to.
+            read = getattr(self.file, 'read1', self.file.read)
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            while True:
+                chunk = read(self._chunk_size)
+                # The decoded string is not needed, but decoding raises
+                # UnicodeDecodeError if the content is not UTF-8.
+                decoder.decode(chunk, final=not chunk)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def _read_content(content):
+    """Read all of the content into a string."""
+    if isinstance(content, str):
+        return content
+    result = content.read()
+    if isinstance(result, bytes):
+        result = result.decode('utf-8')
+    return result
+
+
+def _get_sample(content):
+    """Return the beginning of the content as a string or None.
+
+    File objects are not consumed, so they can be pasted after this.
+    """
+    size = syntax_detect.SAMPLE_SIZE
+    if isinstance(content, str):
+        return content[:size]
+
+    if hasattr(content, 'peek'):
+        # This doesn't block if some data has already been written to a
+        # pipe, and it returns less than size bytes in that case.
+        sample = content.peek(size)[:size]
+    else:
+        try:
+            position = content.tell()
+            sample = content.read(size)
+            content.seek(position)
+        except (AttributeError, OSError, ValueError):
+            # Not seekable.
+            return None
+
+    if isinstance(sample, bytes):
+        # The sample may end in the middle of a character.
+        sample = sample.decode('utf-8', errors='replace')
+    return sample
+
+
+def _detect_syntax(pastebin, content):
+    """Guess the syntax of the content or return None."""
+    sample = _get_sample(content)
+    if sample is None:
+        return None
+    filename = getattr(content, 'name', None)
+    if not isinstance(filename, str):
+        # Files can have integer names.
+        filename = None
+    return syntax_detect.detect(pastebin, sample, filename)
+
+
+def _get_kwargs(pastebin, content, expiry, syntax, title, username):
+    """Return a dictionary of keyword arguments for pastebin.paste."""
+    kwargs = {}
     if 'syntax' in pastebin.paste_args:
-        # TODO: use syntax_default
+        # The syntax must be detected before the content is read.
+        if (syntax is None and
+                _pasting_settings.getboolean('detect-syntax')):
+            syntax = _detect_syntax(pastebin, content)
+        if syntax is None:
+            syntax = pastebin.syntax_default
         kwargs['syntax'] = pastebin.syntax_choices.get(syntax, syntax)
+
+    if getattr(pastebin, 'content_stream', False):
+        kwargs['content'] = ContentStream(content)
+    else:
+        kwargs['content'] = _read_content(content)
+    if 'expiry' in pastebin.paste_args:
+        kwargs['expiry'] = expiry
     if 'title' in pastebin.paste_args:
         kwargs['title'] = title or ''
     if 'username' in pastebin.paste_args:
         kwargs['username'] = username
+    return kwargs
+
+
+def _get_executor(min_workers=None):
+    """Return a thread pool for calling blocking paste functions.
 
-    return pastebin.paste(**kwargs)
+    The pool has at least min_workers threads, and min_workers defaults
+    to the concurrency setting in core.conf. If the current pool is too
+    small, it's replaced with a bigger one. Pastes that are already
+    running in the old pool are not interrupted.
+    """
+    global _executor, _executor_size
+    if min_workers is None:
+        min_workers = _pasting_settings.getint('concurrency')
+
+    with _executor_lock:
+        if _executor is None or _executor_size < min_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            import concurrent.futures
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min_workers,
+                thread_name_prefix='qastetray-paste',
+            )
+            _executor_size = min_workers
+        return _executor
+
+
+async def _paste_async(pastebin, executor, deadline=None, **kwargs):
+    """Paste with pastebin in executor unless it's a coroutine."""
+    if deadline is None:
+        deadline = time.monotonic() + _settings.getfloat('timeout')
+    if inspect.iscoroutinefunction(pastebin.paste):
+        return await _paste_coroutine(pastebin, deadline=deadline, **kwargs)
+
+    # Reading the content from a file may block, so this is done in the
+    # executor too.
+    import asyncio
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor, functools.partial(
+        paste, pastebin, deadline=deadline, **kwargs))
+    try:
+        # The thread gives up by itself when its socket timeouts run
+        # out, but that can take a little longer than the deadline.
+        return await asyncio.wait_for(
+            future, max(0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        raise PasteTimeout("{} didn't respond in time".format(pastebin.name))
+
+
+async def paste_async(pastebin, content, expiry, syntax, title, username,
+                      deadline=None):
+    """Like paste(), but a coroutine.
+
+    Pastebins with a coroutine paste function are awaited directly, and
+    other paste functions are called in a thread pool so they don't
+    block the event loop. The thread pool has as many threads as the
+    concurrency setting in core.conf says, or more if paste_many_async()
+    has been called with a bigger limit.
+    """
+    return await _paste_async(
+        pastebin, _get_executor(), content=content, expiry=expiry,
+        syntax=syntax, title=title, username=username, deadline=deadline)
+
+
+async def paste_many_async(pastes, limit=None, return_exceptions=False,
+                           callback=None):
+    """Make many pastes concurrently.
+
+    pastes should be an iterable of dictionaries of paste_async()
+    arguments. No more than limit pastes are made at the same time, and
+    limit defaults to the concurrency setting in core.conf. The thread
+    pool used for blocking paste functions is made bigger if it has
+    less than limit threads, so blocking pastebins are not limited more
+    than coroutine pastebins.
+
+    The content can also be a function that returns the content. It's
+    called in the thread pool when its paste is started, so no more
+    than limit contents need to be in memory or open at the same time.
+    If the function returns a file object, it's closed when the paste
+    is done.
+
+    If callback is given, it's called with the index of the paste, its
+    URL or exception and the number of seconds it took as soon as each
+    paste is done.
+
+    Return a list of URLs in the same order as the pastes. If
+    return_exceptions is true, exceptions are returned in place of the
+    URLs of failed pastes like asyncio.gather() does.
+    """
+    if limit is None:
+        limit = _pasting_settings.getint('concurrency')
+    if limit < 1:
+        raise ValueError("limit must be positive, not {!r}".format(limit))
+    import asyncio
+    semaphore = asyncio.Semaphore(limit)
+    executor = _get_executor(limit)
+
+    async def paste_one(index, kwargs):
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                result = await _paste_opening_content(executor, kwargs)
+            except Exception as e:
+                if callback is not None:
+                    callback(index, e, time.monotonic() - start)
+                raise
+            if callback is not None:
+                callback(index, result, time.monotonic() - start)
+            return result
+
+    return await asyncio.gather(
+        *(paste_one(index, kwargs) for index, kwargs in enumerate(pastes)),
+        return_exceptions=return_exceptions,
+    )
+
+
+async def _paste_opening_content(executor, kwargs):
+    """Call _paste_async() with paste_async() arguments.
+
+    If the content is a function, it's called in the executor and the
+    file object that it returns is closed after pasting.
+    """
+    import asyncio
+    kwargs = dict(kwargs)
+    opened = None
+    try:
+        if callable(kwargs['content']):
+            loop = asyncio.get_running_loop()
+            opened = kwargs['content'] = await loop.run_in_executor(
+                executor, kwargs['content'])
+        return await _paste_async(executor=executor, **kwargs)
+    finally:
+        if hasattr(opened, 'close'):
+            opened.close()
+
+
+def _get_daemon_executor():
+    """Return an executor that runs everything in new daemon threads."""
+    global _daemon_executor
+    if _daemon_executor is None:
+        import concurrent.futures
+
+        class DaemonThreadExecutor(concurrent.futures.Executor):
+
+            def submit(self, function, *args, **kwargs):
+                future = concurrent.futures.Future()
+
+                def run():
+                    if not future.set_running_or_notify_cancel():
+                        return
+                    try:
+                        result = function(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+
+                threading.Thread(target=run, daemon=True).start()
+                return future
+
+        _daemon_executor = DaemonThreadExecutor()
+    return _daemon_executor
+
+
+def _get_closest_expiry(pastebin, expiry):
+    """Return the pastebin's expiry that is closest to expiry.
+
+    The shortest expiry that is at least as long as the given expiry is
+    preferred, and -1 means that the paste never expires. The pastebin's
+    default expiry is used if expiry is None.
+    """
+    if expiry is None or expiry in pastebin.expiry_days:
+        return pastebin.expiry_days[0] if expiry is None else expiry
+
+    def days(expiry):
+        return float('inf') if expiry < 0 else expiry
+
+    longer = [e for e in pastebin.expiry_days if days(e) >= days(expiry)]
+    if longer:
+        return min(longer, key=days)
+    return max(pastebin.expiry_days, key=days)
+
+
+async def paste_hedged_async(pastebins, content, expiry=None, syntax=None,
+                             title=None, username=None, stagger=None,
+                             deadline=None):
+    """Paste the same content to many pastebins, fastest one wins.
+
+    pastebins should be a list of pastebins, the preferred pastebin
+    first. Pasting is started with the first pastebin, and with the next
+    one whenever stagger seconds have passed or a paste has failed. The
+    stagger defaults to the hedge-stagger setting in core.conf and it
+    can also be a list of delays for the pastebins after the first one.
+
+    As soon as one of the pastes succeeds, the others are cancelled.
+    Blocking paste functions that are already running can't be stopped,
+    so they are left running in daemon threads and their results are
+    ignored.
+
+    The content can be a string, a file object or a function that
+    returns a string or a file object like in paste_many_async(). File
+    objects are read into a string first because every pastebin needs
+    the whole content. The expiry and syntax are changed to each
+    pastebin's closest expiry and matching syntax choice, and the syntax
+    is detected if the pastebin doesn't have a matching choice.
+
+    All pastes must be done before the deadline, and it defaults to the
+    timeout setting in core.conf like with paste().
+
+    Return a (url, pastebin) tuple. If all pastes fail, the exception of
+    the first pastebin is raised.
+    """
+    import asyncio
+    if not pastebins:
+        raise ValueError("at least one pastebin is needed")
+    if deadline is None:
+        deadline = time.monotonic() + _settings.getfloat('timeout')
+    if stagger is None:
+        stagger = _pasting_settings.getfloat('hedge-stagger')
+    if isinstance(stagger, (int, float)):
+        stagger = [stagger] * (len(pastebins) - 1)
+
+    # Python waits for the thread pool's threads when it exits, so a
+    # slow pastebin would keep QasteTray running after another pastebin
+    # has succeeded.
+    executor = _get_daemon_executor()
+    if not isinstance(content, str) and not callable(content):
+        loop = asyncio.get_running_loop()
+        content = await loop.run_in_executor(
+            executor, _read_content, content)
+
+    def start(pastebin):
+        resolved_syntax = None
+        if syntax is not None and 'syntax' in pastebin.paste_args:
+            resolved_syntax = syntax_index.get(pastebin).resolve(syntax)
+        task = asyncio.ensure_future(_paste_opening_content(executor, {
+            'pastebin': pastebin,
+            'content': content,
+            'expiry': _get_closest_expiry(pastebin, expiry),
+            'syntax': resolved_syntax,
+            'title': title,
+            'username': username,
+            'deadline': deadline,
+        }))
+        tasks[task] = pastebin
+        return task
+
+    tasks = {}
+    errors = {}
+    waiting = list(pastebins)
+    running = {start(waiting.pop(0))}
+    try:
+        while running:
+            timeout = stagger[len(tasks) - 1] if waiting else None
+            done, running = await asyncio.wait(
+                running, timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), tasks[task]
+                errors[tasks[task]] = task.exception()
+            if waiting:
+                # The stagger delay has passed or a paste failed.
+                running.add(start(waiting.pop(0)))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    raise errors[pastebins[0]]
+
+
+def paste_hedged(pastebins, content, expiry=None, syntax=None, title=None,
+                 username=None, stagger=None, deadline=None):
+    """Like paste_hedged_async(), but not a coroutine.
+
+    This runs a new event loop, so this can't be called from a running
+    event loop.
+    """
+    import asyncio
+    return asyncio.run(paste_hedged_async(
+        pastebins, content, expiry, syntax, title, username, stagger,
+        deadline))
+
+
+def _get_adapter(key):
+    """Return the shared requests adapter for a (scheme, host) tuple."""
+    # Importing requests is slow, so it's not imported when this module
+    # is imported.
+    import requests
+
+    with _sessions_lock:
+        if key not in _adapters:
+            # The adapter's connection pool is thread-safe, so all
+            # threads can share it.
+            _adapters[key] = requests.adapters.HTTPAdapter(
+                pool_connections=1,     # Each adapter is used with one host.
+                pool_maxsize=_settings.getint('pool-size'),
+                max_retries=_settings.getint('retries'),
+            )
+        return _adapters[key]
+
+
+def _get_session_class():
+    """Return a requests.Session subclass with default timeouts."""
+    global _session_class
+    if _session_class is None:
+        import requests
+
+        class Session(requests.Session):
+
+            def request(self, *args, **kwargs):
+                # Pastebins that don't pass a timeout get the timeout
+                # of the current paste.
+                if kwargs.get('timeout') is None:
+                    kwargs['timeout'] = get_timeout()
+                return super().request(*args, **kwargs)
+
+        _session_class = Session
+    return _session_class
+
+
+def get_session(url):
+    """Return a requests.Session for pasting to url.
+
+    requests.Session objects are not thread-safe and they store cookies,
+    so each thread gets its own session for each scheme and host. All
+    sessions for the same host share a pool of keep-alive connections,
+    so pasting many times doesn't need a new handshake for each paste.
+    The sessions use get_timeout() for requests that have no timeout.
+    """
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    try:
+        sessions = _local.sessions
+    except AttributeError:
+        sessions = _local.sessions = {}
+
+    if key not in sessions:
+        session = _get_session_class()()
+        session.headers['User-Agent'] = (_settings['user-agent'] or
+                                         USER_AGENT)
+        session.mount('{}://{}/'.format(*key), _get_adapter(key))
+        sessions[key] = session
+    return sessions[key]
+
+
+def close_sessions():
+    """Close all connections opened by sessions from get_session().
+
+    New connections will be opened if the sessions are used again.
+    """
+    with _sessions_lock:
+        for adapter in _adapters.values():
+            adapter.close()
 
 
 # Rest of this file is loader definitions. More loaders can be added to
@@ -127,5 +1070,187 @@ loaders['.so'] = _import_loader     # Pastebins can be written in C.
 loaders['.pyd'] = _import_loader
 
 
-# TODO: Add an XML, JSON or .conf loader and port some of the default
-# pastebins to use it.
+
+# The JSON loader loads pastebins that are described with data instead
+# of Python code. The request and the response handling are compiled to
+# a _RequestPlan when the pastebin is loaded, so pasting doesn't need
+# to look at the JSON anymore. See writing-pastebins.md for a
+# description of the format.
+
+_template_formatter = string.Formatter()
+
+
+def _compile_template(template, paste_args, where):
+    """Return a function that fills in a template.
+
+    The function takes a dictionary of paste arguments. Strings are
+    formatted with str.format(), so "{content}" is replaced with the
+    content. A string that is nothing but a single field, like
+    "{expiry}", is replaced with the argument itself without converting
+    it to a string. Dictionaries and lists are compiled recursively and
+    other values are used as is.
+    """
+    if isinstance(template, dict):
+        compiled = {key: _compile_template(value, paste_args, where)
+                    for key, value in template.items()}
+        return lambda kwargs: {key: function(kwargs)
+                               for key, function in compiled.items()}
+
+    if isinstance(template, list):
+        compiled = [_compile_template(value, paste_args, where)
+                    for value in template]
+        return lambda kwargs: [function(kwargs) for function in compiled]
+
+    if not isinstance(template, str):
+        return lambda kwargs: template
+
+    try:
+        fields = [field for text, field, spec, conversion
+                  in _template_formatter.parse(template)
+                  if field is not None]
+    except ValueError as e:
+        raise ValueError("{}: invalid template {!r}: {}"
+                         .format(where, template, e)) from None
+    for field in fields:
+        if field not in paste_args:
+            raise ValueError("{}: {!r} is not in paste_args"
+                             .format(where, field))
+
+    if len(fields) == 1 and template == '{' + fields[0] + '}':
+        return operator.itemgetter(fields[0])
+    return lambda kwargs: template.format(**kwargs)
+
+
+def _compile_response(spec, where):
+    """Return a function that gets the paste URL from a response."""
+    kind = spec.get('type', 'text')
+    if kind == 'text':
+        def extract(response):
+            return response.text.strip()
+    elif kind == 'url':
+        # The URL after following redirects.
+        def extract(response):
+            return response.url
+    elif kind == 'json':
+        path = spec.get('path')
+        if not isinstance(path, list) or not path:
+            raise ValueError("{}: the path of a json response must be a "
+                             "non-empty list".format(where))
+
+        def extract(response):
+            value = response.json()
+            for key in path:
+                value = value[key]
+            return value
+    else:
+        raise ValueError("{}: unknown response type {!r}"
+                         .format(where, kind))
+
+    prefix = spec.get('prefix', '')
+    return lambda response: prefix + str(extract(response))
+
+
+class _RequestPlan:
+    """A compiled description of how to paste with a JSON pastebin."""
+
+    # These are the keys of the request object, and the values are
+    # the keyword arguments of requests.Session.request().
+    _REQUEST_PARTS = {
+        'params': 'params',
+        'headers': 'headers',
+        'form': 'data',
+        'json': 'json',
+        'data': 'data',
+    }
+
+    def __init__(self, request, response, paste_args, where):
+        """Compile the request and response specifications."""
+        if not isinstance(request.get('url'), str):
+            raise ValueError("{}: the request needs a url".format(where))
+        self.url = request['url']
+        self.method = request.get('method', 'POST').upper()
+
+        unknown = set(request) - set(self._REQUEST_PARTS) - {'url', 'method'}
+        if unknown:
+            raise ValueError("{}: unknown request keys: {}"
+                             .format(where, ', '.join(sorted(unknown))))
+        if len({'form', 'json', 'data'} & set(request)) > 1:
+            raise ValueError("{}: only one of form, json and data can be "
+                             "used".format(where))
+
+        self._parts = {
+            self._REQUEST_PARTS[key]: _compile_template(
+                request[key], paste_args, where)
+            for key in self._REQUEST_PARTS if key in request
+        }
+
+        # The content can be streamed when it's the whole request body.
+        self.content_stream = (request.get('data') == '{content}')
+        self._extract = _compile_response(response, where)
+
+    def __call__(self, **kwargs):
+        """Paste and return the URL."""
+        if self.content_stream:
+            kwargs['content'] = iter(kwargs['content'])
+        request_kwargs = {key: function(kwargs)
+                          for key, function in self._parts.items()}
+        if isinstance(request_kwargs.get('data'), str):
+            request_kwargs['data'] = request_kwargs['data'].encode('utf-8')
+
+        session = get_session(self.url)
+        response = session.request(self.method, self.url,
+                                   timeout=get_timeout(), **request_kwargs)
+        response.raise_for_status()
+        return self._extract(response)
+
+
+class _JSONPastebin:
+    """A pastebin loaded from a JSON file."""
+
+    def __init__(self, filepath, info):
+        """Check the pastebin information and compile the request plan."""
+        for key in ['name', 'url', 'expiry_days', 'paste_args', 'request']:
+            if key not in info:
+                raise ValueError("{}: {!r} is missing".format(filepath, key))
+
+        self.name = info['name']
+        self.url = info['url']
+        self.expiry_days = list(info['expiry_days'])
+        self.paste_args = list(info['paste_args'])
+        if 'content' not in self.paste_args:
+            raise ValueError("{}: 'content' must be in paste_args"
+                             .format(filepath))
+
+        if 'syntax' in self.paste_args:
+            try:
+                self.syntax_default = info['syntax_default']
+                self.syntax_choices = info['syntax_choices']
+            except KeyError as e:
+                raise ValueError("{}: pastebins with syntax in paste_args "
+                                 "need {}".format(filepath, e)) from None
+            if self.syntax_default not in self.syntax_choices:
+                raise ValueError("{}: syntax_default must be a key of "
+                                 "syntax_choices".format(filepath))
+
+        self.paste = _RequestPlan(info['request'], info.get('response', {}),
+                                  self.paste_args, filepath)
+        self.content_stream = self.paste.content_stream
+        self.max_size = info.get('max_size')
+
+    def __repr__(self):
+        """Return a string representation of the pastebin."""
+        return '<JSON pastebin {!r}>'.format(self.name)
+
+
+def _json_loader(filepath):
+    """Load a pastebin from a JSON file."""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        try:
+            info = json.load(f)
+        except ValueError as e:
+            raise ValueError("{}: {}".format(filepath, e)) from None
+    if not isinstance(info, dict):
+        raise ValueError("{}: the JSON must be an object".format(filepath))
+    return _JSONPastebin(filepath, info)
+
+loaders['.json'] = _json_loader
@@ -0,0 +1,191 @@
+# Copyright (c) 2016 Akuli
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Health and latency statistics of pastebins.
+
+pastebin_manager records how long each paste took and whether it
+succeeded. The statistics are stored in a JSON file in the cache
+directory, so they are shared by all QasteTray processes. A pastebin
+that fails many times in a row is put in a cooldown, and choose() avoids
+it until the cooldown is over.
+
+The AUTO pseudo-pastebin name can be used in user interfaces for
+letting choose() pick the healthiest and fastest pastebin.
+"""
+
+import json
+import os
+import threading
+import time
+
+from qastetray.core import filepaths, setting_manager
+
+
+AUTO = 'auto'
+
+_STATS_FILE = os.path.join(filepaths.usercachedir, 'pastebin-stats.json')
+
+# This many recent failures are remembered for showing them to the user.
+_MAX_FAILURES = 5
+
+# Pastebins without statistics are assumed to be this fast, so they get
+# tried too.
+_DEFAULT_LATENCY = 1.0
+
+_settings = setting_manager.get('core.conf')['PastebinStats']
+_lock = threading.Lock()
+
+
+def _read():
+    """Read the statistics file."""
+    try:
+        with open(_STATS_FILE, 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(stats, dict):
+        return {}
+    return stats
+
+
+def _write(stats):
+    """Replace the statistics file."""
+    filepaths.make_dirs(_STATS_FILE)
+    temppath = '{}.{}.tmp'.format(_STATS_FILE, os.getpid())
+    with open(temppath, 'w', encoding='utf-8') as f:
+        json.dump(stats, f)
+    os.replace(temppath, _STATS_FILE)
+
+
+def record(pastebin_name, elapsed, error=None):
+    """Record a paste that took elapsed seconds.
+
+    error should be the exception if the paste failed.
+    """
+    if not _settings.getboolean('enabled'):
+        return
+    now = time.time()
+    window = _settings.getint('window')
+
+    with _lock:
+        # The file is read again because other processes may have
+        # changed it.
+        stats = _read()
+        entry = stats.setdefault(pastebin_name, {
+            'results': [],          # 1 for successes and 0 for failures
+            'latencies': [],        # seconds, successes only
+            'failures': [],         # [[time, message], ...]
+            'failures_in_row': 0,
+            'cooldown_until': 0,
+        })
+
+        if error is None:
+            entry['results'].append(1)
+            entry['latencies'].append(elapsed)
+            entry['failures_in_row'] = 0
+            entry['cooldown_until'] = 0
+        else:
+            entry['results'].append(0)
+            entry['failures'].append(
+                [now, '{}: {}'.format(type(error).__name__, error)])
+            entry['failures_in_row'] += 1
+            if (entry['failures_in_row'] >=
+                    _settings.getint('failures-before-cooldown')):
+                entry['cooldown_until'] = now + _settings.getint('cooldown')
+
+        del entry['results'][:-window]
+        del entry['latencies'][:-window]
+        del entry['failures'][:-_MAX_FAILURES]
+        try:
+            _write(stats)
+        except OSError:
+            # The statistics are not needed for pasting.
+            pass
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[round(percent / 100 * (len(values) - 1))]
+
+
+def get(pastebin_name):
+    """Return a dictionary of statistics about a pastebin.
+
+    The dictionary has these keys:
+
+      pastes        number of recent pastes that the statistics are from
+      success_rate  fraction of the recent pastes that succeeded, or None
+      p50, p90      latency percentiles in seconds, or None
+      failures      list of (time, message) tuples, newest last
+      cooldown      seconds until the cooldown is over, 0 if none
+    """
+    with _lock:
+        entry = _read().get(pastebin_name, {})
+    results = entry.get('results', [])
+    latencies = entry.get('latencies', [])
+    return {
+        'pastes': len(results),
+        'success_rate': sum(results) / len(results) if results else None,
+        'p50': _percentile(latencies, 50) if latencies else None,
+        'p90': _percentile(latencies, 90) if latencies else None,
+        'failures': [tuple(failure) for failure in entry.get('failures', [])],
+        'cooldown': max(0, entry.get('cooldown_until', 0) - time.time()),
+    }
+
+
+def _supports(pastebin, paste_args, expiry):
+    if not set(paste_args) <= set(pastebin.paste_args):
+        return False
+    return expiry is None or expiry in pastebin.expiry_days
+
+
+def choose(pastebins, paste_args=(), expiry=None):
+    """Return the best pastebin from an iterable of pastebins.
+
+    Only pastebins that accept all paste_args and the expiry, if it's
+    not None, are considered. Pastebins in cooldown are used only if all
+    other pastebins are in cooldown too. The best pastebin has the
+    smallest median latency divided by success rate.
+
+    LookupError is raised if no pastebin is suitable.
+    """
+    candidates = [pastebin for pastebin in pastebins
+                  if _supports(pastebin, paste_args, expiry)]
+    if not candidates:
+        raise LookupError("no pastebin supports {} and expiry {}".format(
+            ', '.join(paste_args), expiry))
+
+    with _lock:
+        stats = _read()
+    now = time.time()
+
+    def sort_key(pastebin):
+        entry = stats.get(pastebin.name, {})
+        cooldown = max(0, entry.get('cooldown_until', 0) - now)
+        results = entry.get('results', [])
+        latencies = entry.get('latencies', [])
+        success_rate = sum(results) / len(results) if results else 1
+        latency = (_percentile(latencies, 50) if latencies
+                   else _DEFAULT_LATENCY)
+        # A pastebin that always fails is slower than anything else.
+        return (cooldown, latency / max(success_rate, 0.01))
+
+    return min(candidates, key=sort_key)
@@ -21,15 +21,82 @@
 
 """Manage recent pastes.
 
-The recent paste list is stored as json in the settings.
+The recent pastes are stored in an append-only journal file in the user
+configuration directory. Each line of the journal is a compact JSON
+list for one paste, so adding a recent paste writes just one line no
+matter how long the history is. The journal is rewritten without the
+pastes that don't fit in maxlen anymore when it has grown much longer
+than the recent paste list, and the journal is read only when the
+recent pastes are actually needed.
 """
 
+import collections
 import json
+import os
+import threading
+import time
 
-from qastetray.core import setting_manager
+from qastetray.core import filepaths, setting_manager
 
 
 _settings = setting_manager.get('core.conf')['RecentPastes']
+JOURNAL_FILE = os.path.join(filepaths.userconfigdir, 'recent-pastes.jsonl')
+
+# The journal is compacted when it has more than this many unnecessary
+# lines.
+_MAX_GARBAGE_LINES = 1000
+
+# If the journal hasn't been read, it's read and compacted when it's
+# bigger than _MAX_UNREAD_SIZE plus _LINE_SIZE for each recent paste.
+# Typical lines are much shorter than _LINE_SIZE.
+_MAX_UNREAD_SIZE = 1024 * 1024
+_LINE_SIZE = 512
+
+
+# The add() method has an argument called time.
+_time = time.time
+
+RecentPaste = collections.namedtuple(
+    'RecentPaste', ['url', 'title', 'pastebin', 'time'])
+
+
+def _dump_line(paste):
+    """Return a journal line for a RecentPaste."""
+    return json.dumps(list(paste), separators=(',', ':')) + '\n'
+
+
+def _parse_line(line):
+    """Return a RecentPaste from a journal line or None if it's broken.
+
+    A line may be broken if QasteTray was killed while writing it.
+    """
+    try:
+        return RecentPaste._make(json.loads(line))
+    except (ValueError, TypeError):
+        return None
+
+
+def read_journal(offset=0):
+    """Yield (paste, offset) pairs from the journal file.
+
+    The pastes are RecentPaste named tuples, oldest first, and offset
+    is the byte position after the paste's line. Reading can be
+    continued later by passing the last offset to this function. An
+    unfinished last line is not read.
+    """
+    try:
+        f = open(JOURNAL_FILE, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            paste = _parse_line(line.decode('utf-8', errors='replace'))
+            if paste is not None:
+                yield paste, offset
 
 
 class _RecentPastes:
@@ -43,16 +110,34 @@ class _RecentPastes:
 
     The maxlen can be negative or 0 to allow an infinite number of
     recent pastes or no recent pastes at all.
+
+    The items are RecentPaste named tuples. If a journal file has been
+    set with load(), added pastes are also appended to it and the
+    journal is read when the pastes are needed for the first time.
     """
 
     def __init__(self):
         """Initialize an empty recent paste list with maxlen -1."""
-        self.__list = []
+        self.__deque = collections.deque()
         self.__maxlen = -1
+        self.__lock = threading.RLock()
+        self._journal = None
+        self._journal_lines = 0
+        self._loaded = True
 
     def clear(self):
-        """Remove all recent pastes."""
-        self.__list.clear()
+        """Remove all recent pastes.
+
+        The journal is emptied too if it has been set.
+        """
+        with self.__lock:
+            self.__deque.clear()
+            if self._journal is not None:
+                filepaths.make_dirs(self._journal)
+                with open(self._journal, 'w', encoding='utf-8'):
+                    pass
+                self._journal_lines = 0
+                self._loaded = True
 
     @property
     def maxlen(self):
@@ -61,48 +146,151 @@ class _RecentPastes:
 
     @maxlen.setter
     def maxlen(self, maxlen):
-        self.__maxlen = int(maxlen)
-        self._shorten_to_maxlen()
+        with self.__lock:
+            self.__maxlen = int(maxlen)
+            self._shorten_to_maxlen()
 
-    def add(self, url, title=''):
+    def add(self, url, title='', pastebin='', time=None):
         """Insert a recent paste to the beginning of the list.
 
-        If title is falsy or omitted, it defaults to url.
+        If title is falsy or omitted, it defaults to url. The time is
+        a time.time() timestamp and it defaults to the current time.
         """
-        self.__list.insert(0, (url, title or url))
-        self._shorten_to_maxlen()
+        if time is None:
+            time = _time()
+        paste = RecentPaste(url, title or url, pastebin, time)
+        with self.__lock:
+            if self._journal is not None:
+                self._append_to_journal(paste)
+            if self._loaded:
+                self.__deque.appendleft(paste)
+                self._shorten_to_maxlen()
+            self.compact()
+
+    def _append_to_journal(self, paste):
+        """Append a line to the journal file."""
+        filepaths.make_dirs(self._journal)
+        with open(self._journal, 'a', encoding='utf-8') as f:
+            f.write(_dump_line(paste))
+        self._journal_lines += 1
+
+    def _read_journal(self):
+        """Read the pastes from the journal if they haven't been read."""
+        with self.__lock:
+            if self._loaded:
+                return
+
+            # Pastes added before reading are in the journal already.
+            pastes = collections.deque(
+                maxlen=(self.maxlen if self.maxlen >= 0 else None))
+            lines = 0
+            try:
+                with open(self._journal, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        lines += 1
+                        paste = _parse_line(line)
+                        if paste is not None:
+                            pastes.appendleft(paste)
+            except FileNotFoundError:
+                pass
+
+            self.__deque = collections.deque(pastes)
+            self._journal_lines = lines
+            self._loaded = True
+
+    def compact(self, force=False):
+        """Rewrite the journal without pastes that are not needed.
+
+        This does nothing unless the journal has many unnecessary lines
+        or force is true.
+        """
+        with self.__lock:
+            if self._journal is None:
+                return
+            if not self._loaded:
+                # Programs that only add pastes never read the journal,
+                # so it must be read when it gets too big.
+                if self.maxlen < 0 and not force:
+                    return
+                try:
+                    size = os.path.getsize(self._journal)
+                except OSError:
+                    return
+                limit = _MAX_UNREAD_SIZE + self.maxlen * _LINE_SIZE
+                if size <= limit and not force:
+                    return
+                self._read_journal()
+
+            garbage = self._journal_lines - len(self.__deque)
+            if garbage <= _MAX_GARBAGE_LINES and not force:
+                return
+
+            filepaths.make_dirs(self._journal)
+            temppath = '{}.{}.tmp'.format(self._journal, os.getpid())
+            with open(temppath, 'w', encoding='utf-8') as f:
+                for paste in reversed(self.__deque):
+                    f.write(_dump_line(paste))
+            os.replace(temppath, self._journal)
+            self._journal_lines = len(self.__deque)
 
     def _shorten_to_maxlen(self):
         """Make the recent paste list shorter or as long as maxlen."""
         if self.maxlen >= 0:
-            del self.__list[self.maxlen:]
+            while len(self.__deque) > self.maxlen:
+                self.__deque.pop()
 
     def __getitem__(self, item):
         """Implement self[int(item)]."""
         if isinstance(item, slice):
             raise TypeError("cannot slice {} objects"
                             .format(type(self).__name__))
-        return self.__list[int(item)]
+        self._read_journal()
+        return self.__deque[int(item)]
+
+    def __iter__(self):
+        """Iterate over the recent pastes, newest first."""
+        self._read_journal()
+        with self.__lock:
+            return iter(list(self.__deque))
 
     def __len__(self):
         """Implement len(self)."""
-        return len(self.__list)
-
+        self._read_journal()
+        return len(self.__deque)
 
 recent_pastes = _RecentPastes()
 
 
 def load():
-    """Load recent pastes."""
+    """Load recent pastes.
+
+    The journal file is not actually read until the recent pastes are
+    needed.
+    """
+    # The journal is unset first, so clear() doesn't empty it.
+    recent_pastes._journal = None
     recent_pastes.clear()
     recent_pastes.maxlen = _settings.getint('maxlen')
-    for args in json.loads(_settings['json']):
-        recent_pastes.add(*args)
+    recent_pastes._journal = JOURNAL_FILE
+    recent_pastes._loaded = False
+
+    # Older versions of QasteTray stored the recent pastes as JSON in
+    # the settings. They are moved to the journal only if there's no
+    # journal yet, and the settings are saved right away so this isn't
+    # done again.
+    if 'json' in _settings:
+        if not os.path.exists(JOURNAL_FILE):
+            old_pastes = json.loads(_settings['json'])
+            for args in reversed(old_pastes):
+                recent_pastes.add(*args, time=0)
+        del _settings['json']
+        setting_manager.save()
 
 
 def save():
-    """Save the list of recent pastes to settings."""
-    # The json module doesn't handle sequences correctly if they don't
-    # inherit from list or tuple.
-    pastelist = list(recent_pastes)
-    _settings['json'] = json.dumps(pastelist)
+    """Make sure the recent paste journal doesn't grow too much.
+
+    The pastes are saved to the journal when they are added, so this
+    only compacts the journal when needed.
+    """
+    recent_pastes.compact()
@@ -19,16 +19,72 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-"""Setting manager for QasteTray."""
+"""Setting manager for QasteTray.
+
+Only configuration files that have changed since they were loaded or
+saved are written when saving. The files are written to a temporary
+file first and then renamed, so a crash while saving never leaves a
+half-written configuration file behind.
+
+Other QasteTray processes may change the files too. check_changes()
+notices that with os.stat() and reloads the changed sections.
+"""
 
 import configparser
+import io
 import os
+import threading
 
 from qastetray.core import filepaths
 
 
 _configs = {}
 
+# The configuration files as strings when they were loaded or saved.
+_saved = {}
+
+# The results of _stat() when the files were loaded or saved.
+_stats = {}
+
+# Lists of functions to call when the files change.
+_subscribers = {}
+
+# An RLock because get() may be called while saving.
+_lock = threading.RLock()
+_save_timer = None
+
+
+def _to_string(config):
+    """Return the content of a configuration file as a string."""
+    file = io.StringIO()
+    config.write(file)
+    return file.getvalue()
+
+
+def _get_paths(filename):
+    return [os.path.join(filepaths.topdir, filename),
+            os.path.join(filepaths.userconfigdir, filename)]
+
+
+def _stat(filename):
+    """Return something that changes when the configuration file does."""
+    result = []
+    for path in _get_paths(filename):
+        try:
+            info = os.stat(path)
+        except OSError:
+            result.append(None)
+        else:
+            result.append((info.st_mtime_ns, info.st_size))
+    return result
+
+
+def _new_config():
+    return configparser.ConfigParser(
+        dict_type=dict,         # No need for ordering
+        interpolation=None,     # Allow % signs in values.
+    )
+
 
 def get(filename):
     """Load a configuration file.
@@ -37,21 +93,211 @@ def get(filename):
     this function is called multiple times with the same argument it
     will always return the same parser.
     """
-    if filename not in _configs:
-        _configs[filename] = configparser.ConfigParser(
-            dict_type=dict,         # No need for ordering
-            interpolation=None,     # Allow % signs in values.
-        )
-        _configs[filename].read([
-            os.path.join(filepaths.topdir, filename),
-            os.path.join(filepaths.userconfigdir, filename),
-        ])
-    return _configs[filename]
+    with _lock:
+        if filename not in _configs:
+            _stats[filename] = _stat(filename)
+            config = _new_config()
+            config.read(_get_paths(filename))
+            _configs[filename] = config
+            _saved[filename] = _to_string(config)
+        return _configs[filename]
+
+
+def _write(filename, content):
+    """Replace a user-wide configuration file with content."""
+    path = os.path.join(filepaths.userconfigdir, filename)
+    filepaths.make_dirs(path)
+    temppath = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temppath, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temppath, path)
+    except OSError:
+        try:
+            os.remove(temppath)
+        except OSError:
+            pass
+        raise
+
+
+def _get_changes(filename):
+    """Return the changes made in this process to a configuration file.
+
+    The changes are a dictionary with section names as keys. The values
+    are None for removed sections, and dictionaries with option names
+    as keys and new values or None for removed options otherwise.
+    """
+    old = _new_config()
+    old.read_string(_saved[filename])
+    config = _configs[filename]
+
+    changes = {}
+    for name in set(old.sections()) | set(config.sections()):
+        if name not in config:
+            changes[name] = None
+            continue
+        old_section = dict(old[name]) if name in old else {}
+        section = dict(config[name])
+        changed_options = {
+            key: section.get(key)
+            for key in set(old_section) | set(section)
+            if old_section.get(key) != section.get(key)}
+        if changed_options or name not in old:
+            changes[name] = changed_options
+    return changes
+
+
+def _merge(filename):
+    """Apply this process's changes to the file's content on disk.
+
+    Return the merged configparser.ConfigParser.
+    """
+    changes = _get_changes(filename)
+    merged = _new_config()
+    merged.read(_get_paths(filename))
+    for name, options in changes.items():
+        if options is None:
+            merged.remove_section(name)
+            continue
+        if name not in merged:
+            merged.add_section(name)
+        for key, value in options.items():
+            if value is None:
+                merged.remove_option(name, key)
+            else:
+                merged[name][key] = value
+    return merged
 
 
 def save():
-    """Save all loaded configuration files."""
-    for filename, config in _configs.items():
-        path = os.path.join(filepaths.userconfigdir, filename)
-        with open(path, 'w') as f:
-            config.write(f)
+    """Save all loaded configuration files that have changed.
+
+    Other processes may have changed the files after they were loaded,
+    so only the options that were changed in this process are written
+    over the files' current content. Changes made by other processes
+    are loaded like check_changes() does.
+
+    This can be called from any thread.
+    """
+    global _save_timer
+    to_notify = []
+    with _lock:
+        if _save_timer is not None:
+            _save_timer.cancel()
+            _save_timer = None
+        for filename, config in _configs.items():
+            if _to_string(config) == _saved[filename]:
+                continue
+            merged = _merge(filename)
+            content = _to_string(merged)
+            _write(filename, content)
+
+            changed = set()
+            for name in merged.sections():
+                if (name not in config or
+                        dict(config[name]) != dict(merged[name])):
+                    # This changes the section in place, see _reload().
+                    config[name] = merged[name]
+                    changed.add(name)
+            _saved[filename] = content
+            _stats[filename] = _stat(filename)
+            if changed:
+                to_notify.append((filename, changed))
+    _notify(to_notify)
+
+
+def schedule_save(delay=1):
+    """Save the configuration files after delay seconds.
+
+    If this is called again before the files are saved the delay starts
+    again, so changing many settings at once saves only once.
+    """
+    global _save_timer
+    with _lock:
+        if _save_timer is not None:
+            _save_timer.cancel()
+        _save_timer = threading.Timer(delay, save)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+
+def subscribe(filename, callback):
+    """Call callback when another process changes a configuration file.
+
+    The callback is called with the configparser.ConfigParser and a set
+    of changed section names as arguments.
+    """
+    _subscribers.setdefault(filename, []).append(callback)
+
+
+def _reload(filename):
+    """Reload changed sections of a configuration file.
+
+    Return a set of section names that were reloaded.
+    """
+    config = _configs[filename]
+    old = _new_config()
+    old.read_string(_saved[filename])
+    new = _new_config()
+    new.read(_get_paths(filename))
+
+    changed = set()
+    for name in set(old.sections()) | set(new.sections()):
+        if name not in new:
+            # The section is left as is, because code that uses it
+            # might not expect it to disappear.
+            continue
+        if name in old and dict(old[name]) == dict(new[name]):
+            continue
+        # This changes the section in place, so section objects like
+        # get('core.conf')['Pasting'] get the new values. Sections that
+        # were changed only in this process keep their new values.
+        config[name] = new[name]
+        changed.add(name)
+    _saved[filename] = _to_string(new)
+    return changed
+
+
+def check_changes():
+    """Reload configuration files that were changed by another process.
+
+    This checks the modification times of the files, so this is fast
+    enough to call often. Subscribers of changed files are called in
+    the current thread.
+    """
+    to_notify = []
+    with _lock:
+        for filename in _configs:
+            stat = _stat(filename)
+            if stat == _stats[filename]:
+                continue
+            _stats[filename] = stat
+            changed = _reload(filename)
+            if changed:
+                to_notify.append((filename, changed))
+
+    _notify(to_notify)
+
+
+def _notify(to_notify):
+    """Call subscribers with a list of (filename, changed) pairs."""
+    for filename, changed in to_notify:
+        for callback in _subscribers.get(filename, []):
+            callback(_configs[filename], changed)
+
+
+def watch(interval=2):
+    """Call check_changes() every interval seconds in a daemon thread.
+
+    Return a threading.Event that stops watching when it's set.
+    """
+    stop = threading.Event()
+
+    def watcher():
+        while not stop.wait(interval):
+            check_changes()
+
+    threading.Thread(target=watcher, daemon=True).start()
+    return stop
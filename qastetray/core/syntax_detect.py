@@ -0,0 +1,197 @@
+# Copyright (c) 2016 Akuli
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Guess the syntax highlighting of paste content.
+
+The guess is based on the shebang, a vim or Emacs modeline, the file
+name's extension and a few cheap regular expressions, in that order.
+Only the first SAMPLE_SIZE characters of the content are ever looked
+at, so detecting the syntax of a huge paste is as fast as detecting the
+syntax of a small paste.
+"""
+
+import os
+import re
+
+from qastetray.core import syntax_index
+
+
+SAMPLE_SIZE = 8192
+
+# Detected languages are looked up from pastebins' syntax choices with
+# these names, and the first name the pastebin has is used. Aliases in
+# syntax_index work here too.
+_CANDIDATES = {
+    'bash': ['bash'],
+    'c': ['c'],
+    'c++': ['c++'],
+    'css': ['css'],
+    'diff': ['diff'],
+    'go': ['go'],
+    'html': ['html'],
+    'ini': ['ini'],
+    'java': ['java'],
+    'javascript': ['javascript'],
+    'json': ['json', 'javascript'],
+    'lua': ['lua'],
+    'makefile': ['makefile'],
+    'markdown': ['markdown'],
+    'perl': ['perl'],
+    'php': ['php'],
+    'python': ['python 3', 'python'],
+    'python traceback': ['python 3 traceback', 'python traceback',
+                         'python 3.0 traceback'],
+    'ruby': ['ruby'],
+    'rust': ['rust'],
+    'sql': ['sql'],
+    'xml': ['xml'],
+    'yaml': ['yaml'],
+}
+
+_INTERPRETERS = {
+    'bash': 'bash', 'sh': 'bash', 'zsh': 'bash', 'dash': 'bash',
+    'node': 'javascript', 'nodejs': 'javascript',
+    'perl': 'perl', 'php': 'php', 'python': 'python', 'ruby': 'ruby',
+    'lua': 'lua',
+}
+
+_EXTENSIONS = {
+    '.bash': 'bash', '.c': 'c', '.cc': 'c++', '.cfg': 'ini',
+    '.cpp': 'c++', '.css': 'css', '.cxx': 'c++', '.diff': 'diff',
+    '.go': 'go', '.h': 'c', '.hpp': 'c++', '.htm': 'html',
+    '.html': 'html', '.ini': 'ini', '.java': 'java', '.js': 'javascript',
+    '.json': 'json', '.lua': 'lua', '.md': 'markdown', '.patch': 'diff',
+    '.php': 'php', '.pl': 'perl', '.py': 'python', '.pyw': 'python',
+    '.rb': 'ruby', '.rs': 'rust', '.sh': 'bash', '.sql': 'sql',
+    '.xml': 'xml', '.yaml': 'yaml', '.yml': 'yaml',
+}
+
+_FILENAMES = {
+    'GNUmakefile': 'makefile',
+    'Makefile': 'makefile',
+    'makefile': 'makefile',
+}
+
+_SHEBANG = re.compile(r'^#!\s*(\S+)(?:[ \t]+(\S+))?')
+_VIM_MODELINE = re.compile(r'\bvim?:.*\b(?:ft|filetype|syntax)=(\w+)')
+_EMACS_MODELINE = re.compile(r'-\*-\s*(?:.*mode:\s*)?([\w+-]+)[\s;]*-\*-')
+
+# These are tried in order, so more specific patterns must come first.
+_HEURISTICS = [
+    ('python traceback',
+     re.compile(r'^Traceback \(most recent call last\):$', re.M)),
+    ('diff', re.compile(r'^(?:diff --git |--- .*\n\+\+\+ |@@ -\d)', re.M)),
+    ('php', re.compile(r'<\?php\b')),
+    ('xml', re.compile(r'\A\s*<\?xml\b')),
+    ('html', re.compile(r'\A\s*<(?:!DOCTYPE html|html)\b', re.I)),
+    ('c++', re.compile(r'^\s*(?:#include\s*<\w+>|using namespace std|'
+                       r'template\s*<)', re.M)),
+    ('c', re.compile(r'^\s*#include\s*[<"]', re.M)),
+    ('rust', re.compile(r'^\s*(?:pub )?fn \w+\s*[(<]|^use \w+::', re.M)),
+    ('go', re.compile(r'^package \w+\s*$(?:.|\n)*^func ', re.M)),
+    ('java', re.compile(r'^\s*public\s+(?:final\s+)?class\s+\w+', re.M)),
+    ('python', re.compile(r'^(?:def \w+\(.*\):|class \w+.*:|'
+                          r'import \w+|from [\w.]+ import )\s*$', re.M)),
+    ('javascript', re.compile(r'^\s*(?:function\s+\w+\s*\(|'
+                              r'(?:const|let|var)\s+\w+\s*=.*;\s*$)', re.M)),
+    ('sql', re.compile(r'^\s*(?:SELECT\s.+\sFROM\s|INSERT\s+INTO\s|'
+                       r'CREATE\s+TABLE\s)', re.M | re.I)),
+    ('json', re.compile(r'\A\s*[{\[]\s*"[^"\n]*"\s*:')),
+    ('bash', re.compile(r'^\s*(?:if \[\[? .*\]\]?; then|'
+                        r'for \w+ in .*; do)\s*$', re.M)),
+]
+
+
+def _from_shebang(first_line):
+    """Return a language from a shebang line or None."""
+    match = _SHEBANG.match(first_line)
+    if match is None:
+        return None
+    program = os.path.basename(match.group(1))
+    if program == 'env' and match.group(2) is not None:
+        program = os.path.basename(match.group(2))
+    # python3.5 and python3 are python.
+    program = re.sub(r'[\d.]+$', '', program)
+    return _INTERPRETERS.get(program)
+
+
+def _from_modeline(lines):
+    """Return a language from a vim or Emacs modeline or None."""
+    for line in lines:
+        match = (_VIM_MODELINE.search(line) or
+                 _EMACS_MODELINE.search(line))
+        if match is not None:
+            language = match.group(1).lower()
+            if language in _CANDIDATES:
+                return language
+            if language in _INTERPRETERS:
+                return _INTERPRETERS[language]
+    return None
+
+
+def _from_filename(filename):
+    """Return a language from a file name or None."""
+    basename = os.path.basename(filename)
+    if basename in _FILENAMES:
+        return _FILENAMES[basename]
+    extension = os.path.splitext(basename)[1].lower()
+    return _EXTENSIONS.get(extension)
+
+
+def detect_language(sample, filename=None):
+    """Guess the language of a sample of the content.
+
+    Only the first SAMPLE_SIZE characters of the sample are used. The
+    language is returned as a lowercase name, like 'python', or None if
+    it couldn't be detected.
+    """
+    sample = sample[:SAMPLE_SIZE]
+    # The modelines are usually in the first few lines, and the last
+    # lines of a file may not be in the sample.
+    lines = sample.split('\n', 5)[:5]
+
+    language = _from_shebang(lines[0]) or _from_modeline(lines)
+    if language is None and filename:
+        language = _from_filename(filename)
+    if language is None:
+        for language, regex in _HEURISTICS:
+            if regex.search(sample) is not None:
+                break
+        else:
+            language = None
+    return language
+
+
+def detect(pastebin, sample, filename=None):
+    """Guess the syntax of a sample of the content for a pastebin.
+
+    Return a key of the pastebin's syntax_choices or None if the syntax
+    couldn't be detected or the pastebin doesn't support it.
+    """
+    language = detect_language(sample, filename)
+    if language is None:
+        return None
+    index = syntax_index.get(pastebin)
+    for candidate in _CANDIDATES[language]:
+        name = index.lookup(candidate)
+        if name is not None:
+            return name
+    return None
@@ -0,0 +1,206 @@
+# Copyright (c) 2016 Akuli
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Fast fuzzy lookup of syntax highlighting choices.
+
+Pastebins have their own names for syntax highlightings, so the user
+can't know if a pastebin calls Python 3 "Python 3", "Python3" or
+"python3". A SyntaxIndex is built from a pastebin's syntax_choices once
+and it finds the choices matching a string case-insensitively by the
+name, the pastebin's own value, a common alias, a prefix or a substring.
+Use get() to get a shared index for a pastebin.
+"""
+
+import bisect
+import threading
+
+
+# Names and file extensions that people commonly use for syntaxes.
+# The values are lowercase syntax choice names, and the first one a
+# pastebin has is used.
+ALIASES = {
+    'bat': ['batchfile', 'batch'],
+    'c#': ['c#'],
+    'cpp': ['c++'],
+    'cs': ['c#'],
+    'csharp': ['c#'],
+    'cxx': ['c++'],
+    'dockerfile': ['docker'],
+    'golang': ['go'],
+    'h': ['c'],
+    'hpp': ['c++'],
+    'hs': ['haskell'],
+    'htm': ['html'],
+    'js': ['javascript'],
+    'kt': ['kotlin'],
+    'make': ['makefile'],
+    'md': ['markdown'],
+    'patch': ['diff'],
+    'pl': ['perl'],
+    'plain': ['plain text', 'text only'],
+    'ps1': ['powershell'],
+    'py': ['python 3', 'python'],
+    'py2': ['python 2', 'python'],
+    'py3': ['python 3', 'python'],
+    'python': ['python 3', 'python'],
+    'python3': ['python 3', 'python'],
+    'rb': ['ruby'],
+    'rs': ['rust'],
+    'sh': ['bash'],
+    'shell': ['bash'],
+    'text': ['plain text', 'text only'],
+    'ts': ['typescript'],
+    'txt': ['plain text', 'text only'],
+    'yml': ['yaml'],
+}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class SyntaxIndex:
+    """An index of syntax choices for fast lookups."""
+
+    def __init__(self, syntax_choices):
+        """Build the index from a syntax_choices dictionary."""
+        # All lookups are done with lowercase strings.
+        self._by_lower_name = {}
+        self._by_lower_value = {}
+        for name, value in syntax_choices.items():
+            self._by_lower_name.setdefault(name.lower(), name)
+            self._by_lower_value.setdefault(str(value).lower(), name)
+
+        # This is sorted for finding prefixes with bisect.
+        self._sorted_lower_names = sorted(self._by_lower_name)
+
+        #: The syntax choice names sorted case-insensitively.
+        self.names = [self._by_lower_name[lower]
+                      for lower in self._sorted_lower_names]
+        self._name_set = frozenset(syntax_choices)
+
+    def __contains__(self, name):
+        """Check if name is exactly one of the syntax choices."""
+        return name in self._name_set
+
+    def _alias(self, lower):
+        """Return the name that an alias refers to or None."""
+        for target in ALIASES.get(lower, []):
+            if target in self._by_lower_name:
+                return self._by_lower_name[target]
+        return None
+
+    def search(self, text, limit=10):
+        """Return a list of syntax choice names matching text.
+
+        The best matches are first. Exact case-insensitive matches are
+        the best, then aliases and the pastebin's own values, then names
+        that start with text and finally names that contain it. At most
+        limit names are returned.
+        """
+        lower = text.strip().lower()
+        if not lower:
+            return []
+
+        result = []
+        seen = set()
+
+        def add(name):
+            if name is not None and name not in seen:
+                seen.add(name)
+                result.append(name)
+
+        add(self._by_lower_name.get(lower))
+        add(self._alias(lower))
+        add(self._by_lower_value.get(lower))
+
+        # Names that start with the text are next to each other in the
+        # sorted list. Shorter names are usually better matches.
+        start = bisect.bisect_left(self._sorted_lower_names, lower)
+        prefixed = []
+        for candidate in self._sorted_lower_names[start:]:
+            if not candidate.startswith(lower):
+                break
+            prefixed.append(candidate)
+        for candidate in sorted(prefixed, key=len):
+            add(self._by_lower_name[candidate])
+
+        if len(result) < limit:
+            containing = [candidate for candidate in self._sorted_lower_names
+                          if lower in candidate]
+            for candidate in sorted(containing, key=len):
+                add(self._by_lower_name[candidate])
+
+        return result[:limit]
+
+    def lookup(self, text):
+        """Return a syntax choice name that text is an exact name for.
+
+        Unlike search() and resolve(), this doesn't match prefixes. The
+        name, an alias or the pastebin's own value must match
+        case-insensitively. Return None if nothing matches.
+        """
+        lower = text.strip().lower()
+        for name in [self._by_lower_name.get(lower), self._alias(lower),
+                     self._by_lower_value.get(lower)]:
+            if name is not None:
+                return name
+        return None
+
+    def resolve(self, text):
+        """Return the syntax choice name that text refers to or None.
+
+        The text must be something that lookup() finds or a prefix of
+        exactly one name. None is returned for ambiguous text, so
+        nothing is guessed.
+        """
+        name = self.lookup(text)
+        if name is not None:
+            return name
+
+        lower = text.strip().lower()
+        if not lower:
+            return None
+        start = bisect.bisect_left(self._sorted_lower_names, lower)
+        prefixed = self._sorted_lower_names[start:start+2]
+        prefixed = [candidate for candidate in prefixed
+                    if candidate.startswith(lower)]
+        if len(prefixed) == 1:
+            return self._by_lower_name[prefixed[0]]
+        return None
+
+
+def get(pastebin):
+    """Return a SyntaxIndex for a pastebin.
+
+    The indexes are cached, so the index is built only once for each
+    pastebin. Pastebins without syntax_choices get an empty index.
+    """
+    choices = getattr(pastebin, 'syntax_choices', {})
+    with _indexes_lock:
+        try:
+            cached_choices, index = _indexes[pastebin.name]
+            if cached_choices is choices:
+                return index
+        except KeyError:
+            pass
+        index = SyntaxIndex(choices)
+        _indexes[pastebin.name] = (choices, index)
+        return index
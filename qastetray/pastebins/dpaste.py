@@ -21,8 +21,9 @@
 
 """This is a dpaste file for QasteTray."""
 
-import requests
-from qastetray import USER_AGENT
+from qastetray.core import pastebin_manager
+
+API_URL = 'http://dpaste.com/api/v2/'
 
 name = 'dpaste'
 url = 'http://dpaste.com/'
@@ -140,8 +141,9 @@ paste_args = ['content', 'expiry', 'syntax', 'title', 'username']
 
 def paste(content, expiry, syntax, title, username):
     """Make a paste to dpaste.com."""
-    response = requests.post(
-        'http://dpaste.com/api/v2/',
+    session = pastebin_manager.get_session(API_URL)
+    response = session.post(
+        API_URL,
         data={
             'content': content,
             'syntax': syntax,
@@ -149,7 +151,7 @@ def paste(content, expiry, syntax, title, username):
             'poster': username,
             'expiry_days': expiry,
         },
-        headers={'User-Agent': USER_AGENT},
+        timeout=pastebin_manager.get_timeout(),
     )
     response.raise_for_status()
     return response.text.strip()
@@ -29,8 +29,9 @@ The API documentation is here:
   https://ghostbin.com/paste/p3qcy
 """
 
-import requests
-from qastetray import USER_AGENT
+from qastetray.core import pastebin_manager
+
+API_URL = 'https://ghostbin.com/paste/new'
 
 name = 'Ghostbin'
 url = 'https://ghostbin.com/'
@@ -388,15 +389,16 @@ paste_args = ['content', 'expiry', 'syntax', 'title']
 
 def paste(content, expiry, syntax, title):
     """Make a paste to dpaste.com."""
-    response = requests.post(
-        'https://ghostbin.com/paste/new',
+    session = pastebin_manager.get_session(API_URL)
+    response = session.post(
+        API_URL,
         data={'text': content},
         params={
             'expire': str(expiry) + 'd',
             'lang': syntax,
             'title': title,
         },
-        headers={'User-Agent': USER_AGENT},
+        timeout=pastebin_manager.get_timeout(),
     )
     response.raise_for_status()
     return response.url
@@ -27,7 +27,9 @@ The API documentation is here:
 
 import json
 
-import requests
+from qastetray.core import pastebin_manager
+
+API_URL = 'https://api.github.com/gists'
 
 name = 'GitHub Gist'
 url = 'https://gist.github.com/'
@@ -38,13 +40,15 @@ paste_args = ['content', 'title']
 
 def paste(content, title):
     """Make a paste to GitHub Gist."""
-    response = requests.post(
-        'https://api.github.com/gists',
+    session = pastebin_manager.get_session(API_URL)
+    response = session.post(
+        API_URL,
         data=json.dumps({
             'description': title,
             'public': False,
             'files': {'file.txt': {'content': content}},
         }),
+        timeout=pastebin_manager.get_timeout(),
     )
     response.raise_for_status()
     return response.json()['html_url']
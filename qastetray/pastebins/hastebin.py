@@ -26,18 +26,25 @@ making the original pasting script. This file is my (Akuli's) version of
 it.
 """
 
-import requests
+from qastetray.core import pastebin_manager
+
+API_URL = 'http://hastebin.com/documents/'
 
 name = 'hastebin'
 url = 'http://hastebin.com/'
 expiry_days = [30]
 
 paste_args = ['content']
+content_stream = True
+# hastebin refuses pastes that are bigger than this.
+max_size = 400000
 
 
 def paste(content):
     """Make a paste to hastebin.com."""
-    response = requests.post('http://hastebin.com/documents/',
-                             data=content.encode('utf-8'))
+    session = pastebin_manager.get_session(API_URL)
+    # The content is sent while it's being read.
+    response = session.post(API_URL, data=iter(content),
+                            timeout=pastebin_manager.get_timeout())
     response.raise_for_status()
     return 'http://hastebin.com/' + response.json()['key']
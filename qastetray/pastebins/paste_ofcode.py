@@ -1,409 +0,0 @@
-# Copyright (c) 2016 Akuli, SquishyStrawberry
-
-# Permission is hereby granted, free of charge, to any person obtaining
-# a copy of this software and associated documentation files (the
-# "Software"), to deal in the Software without restriction, including
-# without limitation the rights to use, copy, modify, merge, publish,
-# distribute, sublicense, and/or sell copies of the Software, and to
-# permit persons to whom the Software is furnished to do so, subject to
-# the following conditions:
-
-# The above copyright notice and this permission notice shall be
-# included in all copies or substantial portions of the Software.
-
-# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
-# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
-# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
-# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
-# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
-# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
-# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
-
-"""This is a Paste ofCode file for QasteTray.
-
-Thanks to SquishyStrawberry <https://github.com/SquishyStrawberry/> for
-making the original pasting script. This file is my (Akuli's) version of
-it.
-"""
-
-import requests
-from qastetray import USER_AGENT
-
-name = 'Paste ofCode'
-url = 'http://paste.ofcode.org/'
-expiry_days = [7]
-syntax_default = 'Text only'
-syntax_choices = {
-    # This was generated with syntax-getters/paste_ofcode.py.
-    "JavaScript+PHP": "js+php",
-    "Zephir": "zephir",
-    "Modula-2": "modula2",
-    "aspx-vb": "aspx-vb",
-    "Befunge": "befunge",
-    "Tea": "tea",
-    "Java Server Page": "jsp",
-    "S": "splus",
-    "Kal": "kal",
-    "MoonScript": "moon",
-    "SWIG": "swig",
-    "MXML": "mxml",
-    "GAS": "gas",
-    "SQL": "sql",
-    "Golo": "golo",
-    "Nemerle": "nemerle",
-    "Cheetah": "cheetah",
-    "BlitzBasic": "blitzbasic",
-    "RQL": "rql",
-    "HTML+Genshi": "html+genshi",
-    "Lua": "lua",
-    "Cryptol": "cryptol",
-    "LiveScript": "live-script",
-    "PowerShell": "powershell",
-    "c-objdump": "c-objdump",
-    "D": "d",
-    "Jade": "jade",
-    "Modelica": "modelica",
-    "LLVM": "llvm",
-    "Lighttpd configuration file": "lighty",
-    "d-objdump": "d-objdump",
-    "Inform 6 template": "i6t",
-    "Literate Agda": "lagda",
-    "PostgreSQL SQL dialect": "postgresql",
-    "Swift": "swift",
-    "Perl6": "perl6",
-    "CSS+Myghty": "css+myghty",
-    "Kotlin": "kotlin",
-    "ANTLR With Perl Target": "antlr-perl",
-    "JavaScript+Smarty": "js+smarty",
-    "PL/pgSQL": "plpgsql",
-    "Opa": "opa",
-    "Twig": "twig",
-    "SPARQL": "sparql",
-    "FoxPro": "foxpro",
-    "GLSL": "glsl",
-    "Makefile": "make",
-    "liquid": "liquid",
-    "JAGS": "jags",
-    "RobotFramework": "robotframework",
-    "CSS": "css",
-    "Ragel": "ragel",
-    "Monkey": "monkey",
-    "Matlab session": "matlabsession",
-    "ANTLR With Java Target": "antlr-java",
-    "HTML+Cheetah": "html+cheetah",
-    "Go": "go",
-    "Mason": "mason",
-    "ResourceBundle": "resource",
-    "Javascript+mozpreproc": "javascript+mozpreproc",
-    "Ragel in Ruby Host": "ragel-ruby",
-    "TypeScript": "ts",
-    "Smali": "smali",
-    "Kconfig": "kconfig",
-    "DylanLID": "dylan-lid",
-    "Shell Session": "shell-session",
-    "Literate Haskell": "lhs",
-    "Literate Idris": "lidr",
-    "Python 3": "python3",
-    "sqlite3con": "sqlite3",
-    "Ragel in C Host": "ragel-c",
-    "Chapel": "chapel",
-    "HTML+Smarty": "html+smarty",
-    "PHP": "php",
-    "Rust": "rust",
-    "Gettext Catalog": "pot",
-    "CSS+Lasso": "css+lasso",
-    "MiniD": "minid",
-    "cpp-objdump": "cpp-objdump",
-    "XML+Django/Jinja": "xml+django",
-    "Rd": "rd",
-    "Clay": "clay",
-    "Elixir": "elixir",
-    "Myghty": "myghty",
-    "Smalltalk": "smalltalk",
-    "PostgreSQL console (psql)": "psql",
-    "SourcePawn": "sp",
-    "Ragel in D Host": "ragel-d",
-    "Objective-C": "objective-c",
-    "CSS+Ruby": "css+erb",
-    "Nimrod": "nimrod",
-    "NASM": "nasm",
-    "JavaScript": "js",
-    "YAML": "yaml",
-    "Nix": "nixos",
-    "Factor": "factor",
-    "Raw token data": "raw",
-    "Gosu": "gosu",
-    "EBNF": "ebnf",
-    "Alloy": "alloy",
-    "CSS+mozpreproc": "css+mozpreproc",
-    "Base Makefile": "basemake",
-    "Elixir iex session": "iex",
-    "Scheme": "scheme",
-    "MuPAD": "mupad",
-    "CFEngine3": "cfengine3",
-    "Fancy": "fancy",
-    "CSS+PHP": "css+php",
-    "C#": "csharp",
-    "Haxe": "hx",
-    "MySQL": "mysql",
-    "objdump": "objdump",
-    "CUDA": "cuda",
-    "Ragel in Objective C Host": "ragel-objc",
-    "CMake": "cmake",
-    "MAQL": "maql",
-    "SquidConf": "squidconf",
-    "ANTLR With Python Target": "antlr-python",
-    "Cypher": "cypher",
-    "ANTLR With ActionScript Target": "antlr-as",
-    "YAML+Jinja": "yaml+jinja",
-    "Coldfusion CFC": "cfc",
-    "dg": "dg",
-    "Diff": "diff",
-    "Hxml": "haxeml",
-    "Docker": "docker",
-    "LSL": "lsl",
-    "Newspeak": "newspeak",
-    "cfstatement": "cfs",
-    "XML+Velocity": "xml+velocity",
-    "Redcode": "redcode",
-    "ECL": "ecl",
-    "Smarty": "smarty",
-    "HTML+Mako": "html+mako",
-    "XML+Evoque": "xml+evoque",
-    "XML+Mako": "xml+mako",
-    "ApacheConf": "apacheconf",
-    "ANTLR With Ruby Target": "antlr-ruby",
-    "Cython": "cython",
-    "Text only": "text",
-    "Boo": "boo",
-    "Brainfuck": "brainfuck",
-    "Objective-J": "objective-j",
-    "Agda": "agda",
-    "CSS+Smarty": "css+smarty",
-    "Io": "io",
-    "CBM BASIC V2": "cbmbas",
-    "XML+Lasso": "xml+lasso",
-    "aspx-cs": "aspx-cs",
-    "mozpercentpreproc": "mozpercentpreproc",
-    "Debian Control file": "control",
-    "AmbientTalk": "at",
-    "Fantom": "fan",
-    "XML+PHP": "xml+php",
-    "HTML+Lasso": "html+lasso",
-    "Django/Jinja": "django",
-    "JSON": "json",
-    "Groovy": "groovy",
-    "VimL": "vim",
-    "XML+Cheetah": "xml+cheetah",
-    "Mako": "mako",
-    "Cirru": "cirru",
-    "Protocol Buffer": "protobuf",
-    "Puppet": "puppet",
-    "Xtend": "xtend",
-    "Python 3.0 Traceback": "py3tb",
-    "Darcs Patch": "dpatch",
-    "OpenEdge ABL": "openedge",
-    "Properties": "properties",
-    "Lasso": "lasso",
-    "Ada": "ada",
-    "MQL": "mql",
-    "verilog": "verilog",
-    "C": "c",
-    "PostScript": "postscript",
-    "Debian Sourcelist": "sourceslist",
-    "Pike": "pike",
-    "FSharp": "fsharp",
-    "HTTP": "http",
-    "JavaScript+Ruby": "js+erb",
-    "Julia console": "jlcon",
-    "REBOL": "rebol",
-    "JavaScript+Genshi Text": "js+genshitext",
-    "VGL": "vgl",
-    "Python Traceback": "pytb",
-    "Logtalk": "logtalk",
-    "Vala": "vala",
-    "systemverilog": "systemverilog",
-    "Hybris": "hybris",
-    "ANTLR With C# Target": "antlr-csharp",
-    "XML+Smarty": "xml+smarty",
-    "Awk": "awk",
-    "Pan": "pan",
-    "Perl": "perl",
-    "Dylan session": "dylan-console",
-    "Objective-C++": "objective-c++",
-    "Ooc": "ooc",
-    "Embedded Ragel": "ragel-em",
-    "TADS 3": "tads3",
-    "Koka": "koka",
-    "Pawn": "pawn",
-    "CSS+Django/Jinja": "css+django",
-    "AspectJ": "aspectj",
-    "Bash": "bash",
-    "Literate Cryptol": "lcry",
-    "HTML+Velocity": "html+velocity",
-    "JavaScript+Mako": "js+mako",
-    "POVRay": "pov",
-    "NSIS": "nsis",
-    "HTML+PHP": "html+php",
-    "RHTML": "rhtml",
-    "ActionScript": "as",
-    "Fortran": "fortran",
-    "Gosu Template": "gst",
-    "COBOLFree": "cobolfree",
-    "ANTLR With CPP Target": "antlr-cpp",
-    "C++": "cpp",
-    "XUL+mozpreproc": "xul+mozpreproc",
-    "Coldfusion HTML": "cfm",
-    "objdump-nasm": "objdump-nasm",
-    "Matlab": "matlab",
-    "Bro": "bro",
-    "HTML+Evoque": "html+evoque",
-    "Red": "red",
-    "Bash Session": "console",
-    "IDL": "idl",
-    "JavaScript+Django/Jinja": "js+django",
-    "Limbo": "limbo",
-    "JavaScript+Cheetah": "js+cheetah",
-    "Todotxt": "todotxt",
-    "Dylan": "dylan",
-    "reg": "registry",
-    "Inform 6": "inform6",
-    "Ceylon": "ceylon",
-    "Ioke": "ioke",
-    "Java": "java",
-    "Clojure": "clojure",
-    "Standard ML": "sml",
-    "Scalate Server Page": "ssp",
-    "RConsole": "rconsole",
-    "CSS+Mako": "css+mako",
-    "Treetop": "treetop",
-    "CoffeeScript": "coffee-script",
-    "Erlang erl session": "erl",
-    "Nit": "nit",
-    "VCTreeStatus": "vctreestatus",
-    "BBCode": "bbcode",
-    "SCSS": "scss",
-    "ABAP": "abap",
-    "APL": "apl",
-    "Rexx": "rexx",
-    "HTML+Myghty": "html+myghty",
-    "CSS+Genshi Text": "css+genshitext",
-    "GAP": "gap",
-    "Groff": "groff",
-    "Delphi": "delphi",
-    "Nginx configuration file": "nginx",
-    "Snobol": "snobol",
-    "MoinMoin/Trac Wiki markup": "trac-wiki",
-    "Python console session": "pycon",
-    "Common Lisp": "common-lisp",
-    "Scilab": "scilab",
-    "AppleScript": "applescript",
-    "PyPy Log": "pypylog",
-    "XSLT": "xslt",
-    "XML+Ruby": "xml+erb",
-    "Stan": "stan",
-    "Julia": "julia",
-    "INI": "ini",
-    "nesC": "nesc",
-    "MOOCode": "moocode",
-    "GoodData-CL": "gooddata-cl",
-    "vhdl": "vhdl",
-    "ANTLR": "antlr",
-    "Haml": "haml",
-    "Haskell": "haskell",
-    "RPMSpec": "spec",
-    "VB.net": "vb.net",
-    "XQuery": "xquery",
-    "NumPy": "numpy",
-    "Eiffel": "eiffel",
-    "ChaiScript": "chai",
-    "Ragel in CPP Host": "ragel-cpp",
-    "Dart": "dart",
-    "Inform 7": "inform7",
-    "IRC logs": "irc",
-    "Prolog": "prolog",
-    "XML+Myghty": "xml+myghty",
-    "Tcsh": "tcsh",
-    "Gnuplot": "gnuplot",
-    "ActionScript 3": "as3",
-    "mozhashpreproc": "mozhashpreproc",
-    "ERB": "erb",
-    "Tcl": "tcl",
-    "Duel": "duel",
-    "Jasmin": "jasmin",
-    "QML": "qml",
-    "XML": "xml",
-    "DTD": "dtd",
-    "JavaScript+Myghty": "js+myghty",
-    "RSL": "rsl",
-    "Python": "python",
-    "OCaml": "ocaml",
-    "BlitzMax": "blitzmax",
-    "Hy": "hylang",
-    "Genshi Text": "genshitext",
-    "Batchfile": "bat",
-    "ca65 assembler": "ca65",
-    "BUGS": "bugs",
-    "Logos": "logos",
-    "JavaScript+Lasso": "js+lasso",
-    "reStructuredText": "rst",
-    "autohotkey": "ahk",
-    "Erlang": "erlang",
-    "Igor": "igor",
-    "Lean": "lean",
-    "Genshi": "genshi",
-    "UrbiScript": "urbiscript",
-    "HTML+Handlebars": "html+handlebars",
-    "eC": "ec",
-    "Mscgen": "mscgen",
-    "Mathematica": "mathematica",
-    "Octave": "octave",
-    "Idris": "idris",
-    "Mask": "mask",
-    "Asymptote": "asy",
-    "HTML+Django/Jinja": "html+django",
-    "Croc": "croc",
-    "Pig": "pig",
-    "Scala": "scala",
-    "TeX": "tex",
-    "HTML+Twig": "html+twig",
-    "Evoque": "evoque",
-    "AutoIt": "autoit",
-    "Handlebars": "handlebars",
-    "Ragel in Java Host": "ragel-java",
-    "ClojureScript": "clojurescript",
-    "Coq": "coq",
-    "Slim": "slim",
-    "Ruby": "rb",
-    "COBOL": "cobol",
-    "HTML": "html",
-    "Velocity": "velocity",
-    "JSON-LD": "jsonld",
-    "Ruby irb session": "rbcon",
-    "QBasic": "qbasic",
-    "ANTLR With ObjectiveC Target": "antlr-objc",
-    "Sass": "sass",
-    "Gherkin": "cucumber",
-    "Scaml": "scaml",
-    "NewLisp": "newlisp",
-    "Isabelle": "isabelle",
-    "Felix": "felix",
-    "Racket": "racket"
-}
-
-paste_args = ['content', 'syntax']
-
-
-def paste(content, syntax):
-    """Make a paste to paste.ofcode.org."""
-    response = requests.post(
-        'http://paste.ofcode.org/',
-        data={
-            'code': content,
-            'language': syntax,
-            'notabot': 'most_likely',
-        },
-        headers={'User-Agent': USER_AGENT},
-    )
-    response.raise_for_status()
-    return response.url
@@ -19,21 +19,72 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-"""This is a termbin file for QasteTray."""
+"""This is a termbin file for QasteTray.
 
+termbin doesn't use HTTP. The content is sent to a raw TCP socket, and
+termbin responds with the URL after the sending side of the connection
+has been shut down.
+"""
+
+import os
 import socket
+import stat
+
+from qastetray.core import pastebin_manager
+
+HOST = 'termbin.com'
+PORT = 9999
+
+# The response is only a URL, so this is much more than needed.
+MAX_RESPONSE_SIZE = 64 * 1024
 
 name = 'termbin'
 url = 'http://termbin.com/'
 expiry_days = [30]
 
 paste_args = ['content']
+content_stream = True
+
+
+def _is_regular_file(file):
+    """Check if socket.sendfile() can send file efficiently."""
+    try:
+        return stat.S_ISREG(os.fstat(file.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        # Not a real file, like an io.BytesIO.
+        return False
 
 
 def paste(content):
     """Make a paste to termbin."""
-    sock = socket.socket()
-    sock.connect(('termbin.com', 9999))
-    sock.send(content.encode('utf-8'))
-    url = sock.recv(1024)
-    return url.decode('utf-8').strip()
+    connect_timeout = pastebin_manager.get_timeout()[0]
+    # create_connection() tries all IPv6 and IPv4 addresses of the host.
+    with socket.create_connection((HOST, PORT),
+                                  timeout=connect_timeout) as sock:
+        # The timeout is set again before each blocking call, so the
+        # whole paste is done before the deadline.
+        sock.settimeout(pastebin_manager.get_timeout()[1])
+
+        if content.file is not None and _is_regular_file(content.file):
+            # The kernel copies the file to the socket without copying
+            # it to Python first. This doesn't check that the file is
+            # valid UTF-8, but termbin doesn't care about that anyway.
+            sock.sendfile(content.file)
+        else:
+            for chunk in content:
+                sock.settimeout(pastebin_manager.get_timeout()[1])
+                sock.sendall(chunk)
+
+        # termbin sends the URL after it knows that everything has been
+        # sent.
+        sock.shutdown(socket.SHUT_WR)
+
+        response = bytearray()
+        while len(response) < MAX_RESPONSE_SIZE:
+            sock.settimeout(pastebin_manager.get_timeout()[1])
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+
+    return response.decode('utf-8').strip()
@@ -0,0 +1,147 @@
+# Copyright (c) 2016 Akuli
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Measure how long QasteTray takes to start.
+
+Profiling is enabled by setting the QASTETRAY_PROFILE environment
+variable or running qastetray or qastetray-cli with --profile. The
+option is checked when this module is imported, so this module must be
+imported before other QasteTray modules to measure their imports too.
+
+When profiling is enabled, the wall times of phase() blocks and the
+slowest imports are printed to stderr by report().
+"""
+
+import atexit
+import contextlib
+import importlib.abc
+import os
+import sys
+import time
+
+
+enabled = bool(os.environ.get('QASTETRAY_PROFILE') or
+               '--profile' in sys.argv[1:])
+
+# The number of imports shown by report().
+TOP_IMPORTS = 15
+
+_start = time.perf_counter()
+_phases = []        # [(name, seconds), ...] in the order they finished
+_marks = []         # [(name, seconds_since_start), ...]
+_imports = {}       # {module_name: [self_seconds, total_seconds]}
+_import_stack = []  # [[module_name, start, children_seconds], ...]
+_reported = False
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Measure the wall time of a with block if profiling is enabled."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - start))
+
+
+def mark(name):
+    """Record how long it took to get here since the start."""
+    if enabled:
+        _marks.append((name, time.perf_counter() - _start))
+
+
+class _TimedLoader:
+    """A loader wrapper that measures how long executing a module takes."""
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __getattr__(self, attribute):
+        return getattr(self._loader, attribute)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        name = module.__name__
+        _import_stack.append([name, time.perf_counter(), 0])
+        try:
+            self._loader.exec_module(module)
+        finally:
+            name, start, children = _import_stack.pop()
+            total = time.perf_counter() - start
+            _imports[name] = [total - children, total]
+            if _import_stack:
+                _import_stack[-1][2] += total
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """Make the other finders' loaders measure import times."""
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader)
+        return spec
+
+
+def report(file=None):
+    """Print the measured times if profiling is enabled.
+
+    This does nothing if it has been called already, and it's called
+    automatically when Python exits.
+    """
+    global _reported
+    if not enabled or _reported:
+        return
+    _reported = True
+    if file is None:
+        file = sys.stderr
+
+    print("QasteTray startup profile, times in milliseconds:", file=file)
+    for name, seconds in _phases:
+        print("{:10.1f}  {}".format(seconds * 1000, name), file=file)
+    for name, seconds in _marks:
+        print("{:10.1f}  {} (since start)".format(seconds * 1000, name),
+              file=file)
+
+    if _imports:
+        print("Slowest imports, self and cumulative:", file=file)
+        slowest = sorted(_imports.items(), key=lambda item: item[1][0],
+                         reverse=True)
+        for name, (self_seconds, total) in slowest[:TOP_IMPORTS]:
+            print("{:10.1f}  {:10.1f}  {}".format(
+                self_seconds * 1000, total * 1000, name), file=file)
+
+
+if enabled:
+    sys.meta_path.insert(0, _ImportTimer())
+    atexit.register(report)
@@ -22,47 +22,135 @@
 """Run QasteTray with a GUI."""
 
 import argparse
+import contextlib
 from gettext import gettext as _
+import os
 import sys
 import time
 
-from PyQt5 import QtWidgets
+# This must be imported first for profiling other imports.
+from qastetray import profiling
 
-from qastetray.core import lock, load_gettext, pastebin_manager, recent_paste_manager, setting_manager
-from qastetray.qt_gui import new_paste, setting_dialog
+# PyQt and most of QasteTray are imported in _run(). A second QasteTray
+# only passes its arguments to the first one and exits, and importing
+# them would take much longer than that.
+from qastetray.core import lock, load_gettext
+from qastetray.qt_gui import single_instance
 
 
-def main(args=None):
-    """Run the program."""
-    if args is None:
-        args = sys.argv
+def _get_content(app, request):
+    """Return the content requested for a new paste window or None."""
+    if request.get('file'):
+        with open(request['file'], 'r', encoding='utf-8') as f:
+            return f.read()
+    if request.get('clipboard'):
+        return app.clipboard().text()
+    return None
 
-    load_gettext()
 
-    # The description is not taken from other files because gettext is
-    # not set up when they are ran.
-    # TODO: Add arguments to parse.
-    parser = argparse.ArgumentParser(description=_("Simple pastebin client."))
-    parser.parse_args(args[1:])
+def _run(args, request):
+    """Start the GUI and return the exit status."""
+    with profiling.phase("import PyQt5"):
+        from PyQt5 import QtCore, QtWidgets
+    from qastetray.core import (pastebin_manager, recent_paste_manager,
+                                setting_manager)
+    from qastetray.qt_gui import new_paste, setting_dialog
 
     try:
-        with lock.locked():
+        with profiling.phase("QApplication"):
             app = QtWidgets.QApplication(args)
+        with profiling.phase("pastebin_manager.load"):
             pastebin_manager.load()
+        with profiling.phase("recent_paste_manager.load"):
             recent_paste_manager.load()
-#            setting_dialog.run()
-            new_paste.new_paste()
-    except lock.IsLocked:
-        QtWidgets.QMessageBox.info(
-            "QasteTray", _("{} is already running.").format("QasteTray"),
-            QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok,
-        )
-        sys.exit()
+
+        # Notice settings changed by other QasteTray processes.
+        settings_timer = QtCore.QTimer()
+        settings_timer.timeout.connect(setting_manager.check_changes)
+        settings_timer.start(2000)
+#        setting_dialog.run()
+
+        def on_request(request):
+            try:
+                content = _get_content(app, request)
+            except (OSError, UnicodeError) as e:
+                QtWidgets.QMessageBox.critical(
+                    None, "QasteTray", str(e), QtWidgets.QMessageBox.Ok,
+                    QtWidgets.QMessageBox.Ok,
+                )
+                return
+            new_paste.new_paste(content)
+
+        try:
+            server = single_instance.listen(on_request)     # NOQA
+        except OSError:
+            # Other QasteTrays can't open windows in this one, but
+            # everything else works.
+            pass
+        with profiling.phase("new_paste"):
+            on_request(request)
+
+        # The window is shown when the event loop has started.
+        def on_shown():
+            profiling.mark("first window shown")
+            profiling.report()
+
+        QtCore.QTimer.singleShot(0, on_shown)
+        return app.exec_()
     finally:
         setting_manager.save()
         recent_paste_manager.save()
 
-    sys.exit(app.exec_())
+
+def _show_already_running(args):
+    """Tell the user that QasteTray is already running."""
+    from PyQt5 import QtWidgets
+    app = QtWidgets.QApplication(args)      # NOQA
+    QtWidgets.QMessageBox.information(
+        None, "QasteTray", _("{} is already running.").format("QasteTray"),
+        QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok,
+    )
+
+
+def main(args=None):
+    """Run the program."""
+    if args is None:
+        args = sys.argv
+
+    with profiling.phase("load_gettext"):
+        load_gettext()
+
+    # The description is not taken from other files because gettext is
+    # not set up when they are ran.
+    parser = argparse.ArgumentParser(description=_("Simple pastebin client."))
+    parser.add_argument(
+        'file', nargs='?',
+        help=_("a file to put in the new paste window"))
+    parser.add_argument(
+        '-c', '--clipboard', action='store_true',
+        help=_("put the clipboard's content in the new paste window"))
+    parser.add_argument(
+        '--profile', action='store_true',
+        help=_("print how long starting takes to stderr"))
+    parsed_args = parser.parse_args(args[1:])
+    request = {
+        # The running QasteTray may have another working directory.
+        'file': (None if parsed_args.file is None
+                 else os.path.abspath(parsed_args.file)),
+        'clipboard': parsed_args.clipboard,
+    }
+
+    with contextlib.ExitStack() as stack:
+        try:
+            stack.enter_context(lock.locked())
+        except lock.IsLocked:
+            if single_instance.send(request):
+                sys.exit()
+            # The running QasteTray is still starting or it's too old
+            # to listen for requests.
+            _show_already_running(args)
+            sys.exit(1)
+        sys.exit(_run(args, request))
 
 
 if __name__ == '__main__':
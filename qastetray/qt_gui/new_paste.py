@@ -26,7 +26,8 @@ import webbrowser
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
-from qastetray.core import pastebin_manager
+from qastetray.core import (pastebin_manager, pastebin_stats, paste_queue,
+                            setting_manager, syntax_index)
 from qastetray.core.setting_manager import settings
 
 
@@ -40,6 +41,7 @@ class _SyntaxHBox(QtWidgets.QHBoxLayout):
     def __init__(self, parent=None):
         """Initialize the HBox and add widgets to it."""
         super().__init__(parent)
+        self._syntax_index = syntax_index.SyntaxIndex({})
 
         self._line_edit = QtWidgets.QLineEdit()
         self._line_edit.textChanged.connect(self._on_text_changed)
@@ -55,7 +57,7 @@ class _SyntaxHBox(QtWidgets.QHBoxLayout):
 
     def _on_text_changed(self, text):
         """Show or hide the icon."""
-        if self._syntaxes and text in self._syntaxes:
+        if text in self._syntax_index:
             self._icon.hide()
         else:
             self._icon.show()
@@ -69,18 +71,17 @@ class _SyntaxHBox(QtWidgets.QHBoxLayout):
             return
         self.setEnabled(True)
 
-        # Autocompletions.
-        self._syntaxes = sorted(
-            getattr(pastebin, 'syntax_choices', {}).keys(),
-            key=str.lower)
-        completer = QtWidgets.QCompleter(self._syntaxes)
+        # Autocompletions. The index is shared with other windows, so
+        # it's built only once for each pastebin.
+        self._syntax_index = syntax_index.get(pastebin)
+        completer = QtWidgets.QCompleter(self._syntax_index.names)
         completer.setFilterMode(QtWidgets.Qt.MatchContains)
         completer.setCaseSensitivity(QtWidgets.Qt.CaseInsensitive)
         self._line_edit.setCompleter(completer)
 
         # Current selection.
         syntax = settings['DefaultSyntax'].get(pastebin.name)
-        if syntax not in self._syntaxes:
+        if syntax not in self._syntax_index:
             syntax = pastebin.syntax_default
         self._line_edit.setText(syntax)
 
@@ -143,6 +144,33 @@ class PastingThread(QtCore.QThread):
         super().__init__()
         self._pastebin = pastebin
         self._kwargs = {arg: getters[arg]() for arg in pastebin.paste_args}
+        self.success = False
+        self.response = None
+        self.ticket = None
+
+    def run(self):
+        """Paste and set success, response and ticket.
+
+        If pasting fails, the paste is queued and ticket is set to its
+        ticket ID.
+        """
+        kwargs = dict.fromkeys(['expiry', 'syntax', 'title', 'username'])
+        kwargs.update(self._kwargs)
+        try:
+            self.response = pastebin_manager.paste(self._pastebin, **kwargs)
+            self.success = True
+        except Exception as e:
+            self.response = str(e)
+            queue_settings = setting_manager.get('core.conf')['PasteQueue']
+            if (isinstance(e, UnicodeError) or
+                    not queue_settings.getboolean('queue-failed')):
+                return
+            try:
+                self.ticket = paste_queue.add(self._pastebin, error=e,
+                                              **kwargs)
+            except OSError:
+                return
+            paste_queue.start_worker()
 
 
 class _NewPasteWindow(QtWidgets.QWidget):
@@ -174,6 +202,7 @@ class _NewPasteWindow(QtWidgets.QWidget):
 
         # 'Forms' in the middle.
         self._pastebin_combo = QtWidgets.QComboBox()
+        self._pastebin_combo.addItem(pastebin_stats.AUTO)
         self._pastebin_combo.addItems(
             sorted(pastebin_manager.pastebins.keys(), key=str.lower))
         self._pastebin_combo.currentTextChanged.connect(
@@ -235,13 +264,19 @@ class _NewPasteWindow(QtWidgets.QWidget):
         hbox.addWidget(self._cancel_button)
 
     def _on_pastebin_changed(self, new_name):
+        if new_name == pastebin_stats.AUTO:
+            # The pastebin is chosen when pasting, so the syntax is
+            # detected and the shortest expiry is used.
+            self._syntax_hbox.setEnabled(False)
+            self._expiry_combo.setEnabled(False)
+            return
         pastebin = pastebin_manager.pastebins[new_name]
         print(pastebin)
 
         # Syntax highlighting.
         if 'syntax' in pastebin.paste_args:
             self._syntax_hbox.setEnabled(True)
-            completions = pastebin.syntax_choices.keys()
+            completions = syntax_index.get(pastebin).names
             self._syntax_completer.model().setStringList(completions)
             syntax = settings['DefaultSyntax'][new_name]
         else:
@@ -265,7 +300,17 @@ class _NewPasteWindow(QtWidgets.QWidget):
         """Start pasting."""
         self._progressbar.setRange(0, 0)  # Move back and forth.
         self.setEnabled(False)
-        pastebin = pastebin_manager.pastebins['dpaste']
+        name = self._pastebin_combo.currentText()
+        if name == pastebin_stats.AUTO:
+            paste_args = ['content']
+            if self._title_line_edit.text():
+                paste_args.append('title')
+            if self._name_line_edit.text():
+                paste_args.append('username')
+            pastebin = pastebin_stats.choose(
+                pastebin_manager.pastebins.values(), paste_args)
+        else:
+            pastebin = pastebin_manager.pastebins[name]
         getters = {
             'content': self._content_text_edit.toPlainText,
             'expiry': lambda: 1,
@@ -290,11 +335,16 @@ class _NewPasteWindow(QtWidgets.QWidget):
             dialog.exec_()
             self.close()
         else:
+            if self._pasting_thread.ticket is None:
+                hint = _("Make sure you have an internet connection or try "
+                         "another pastebin.")
+            else:
+                hint = _("The paste will be pasted again in the background "
+                         "and added to the recent pastes.")
             msg = '\n'.join([
                 _("Pasting failed!"),
                 self._pasting_thread.response,
-                _("Make sure you have an internet connection or try"
-                  "another pastebin."),
+                hint,
             ])
             QtWidgets.QMessageBox.critical(
                 self, _("Error"), msg, QtWidgets.QMessageBox.Ok,
@@ -326,10 +376,19 @@ class _NewPasteWindow(QtWidgets.QWidget):
         event.accept()
 
 
-def new_paste():
-    """Create a new paste."""
+def new_paste(content=None):
+    """Create a new paste.
+
+    The content is put in the new paste window if it's given.
+    """
     window = _NewPasteWindow()
     window.setWindowTitle("New paste")
     window.resize(600, 400)
+    if content is not None:
+        window._content_text_edit.setPlainText(content)
     window.show()
+    # Windows opened because another QasteTray was started must not be
+    # hidden behind other windows.
+    window.raise_()
+    window.activateWindow()
     _new_paste_windows.append(window)
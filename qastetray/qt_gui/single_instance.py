@@ -0,0 +1,124 @@
+# Copyright (c) 2016 Akuli
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Pass new paste requests to a QasteTray GUI that is already running.
+
+The first QasteTray GUI listens on a local socket, and send() gives the
+request of a second launch to it. The second launch doesn't need to
+import PyQt or start a QApplication, so it exits right away. This module
+doesn't import PyQt unless listen() is called.
+
+A request is a JSON object on one line, and the GUI responds with a line
+that says ok when it has received it.
+"""
+
+import getpass
+import json
+import os
+import socket
+import sys
+
+from qastetray.core import filepaths
+
+
+if sys.platform == 'win32':
+    # QLocalServer uses named pipes on Windows.
+    SERVER_NAME = 'qastetray-gui-' + getpass.getuser()
+    _PIPE_PATH = r'\\.\pipe\{}'.format(SERVER_NAME)
+else:
+    SERVER_NAME = os.path.join(filepaths.usercachedir, 'gui.sock')
+
+# Seconds to wait for the running GUI to respond.
+_TIMEOUT = 2
+
+
+def _send_to_pipe(data):
+    """Send data to a named pipe and return the response line."""
+    with open(_PIPE_PATH, 'r+b', buffering=0) as pipe:
+        pipe.write(data)
+        return pipe.readline()
+
+
+def _send_to_socket(data):
+    """Send data to a Unix socket and return the response line."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(_TIMEOUT)
+        sock.connect(SERVER_NAME)
+        sock.sendall(data)
+        with sock.makefile('rb') as f:
+            return f.readline()
+
+
+def send(request):
+    """Send a request dictionary to the running GUI.
+
+    Return True if the GUI received it and False if no GUI is listening.
+    """
+    data = json.dumps(request).encode('utf-8') + b'\n'
+    try:
+        if sys.platform == 'win32':
+            response = _send_to_pipe(data)
+        else:
+            response = _send_to_socket(data)
+    except OSError:
+        return False
+    return response.strip() == b'ok'
+
+
+def listen(callback):
+    """Call callback with each request that send() sends.
+
+    The callback is called in the Qt event loop. Return a QLocalServer
+    that must be kept alive while requests are accepted. Call this only
+    in the process that holds the lock from qastetray.core.lock, because
+    an old server that is not running anymore is removed.
+    """
+    from PyQt5 import QtNetwork
+
+    def on_ready_read(connection):
+        if not connection.canReadLine():
+            # More data will come.
+            return
+        line = bytes(connection.readLine())
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except ValueError:
+            connection.disconnectFromServer()
+            return
+        connection.write(b'ok\n')
+        connection.flush()
+        connection.disconnectFromServer()
+        callback(request)
+
+    def on_new_connection():
+        connection = server.nextPendingConnection()
+        connection.disconnected.connect(connection.deleteLater)
+        connection.readyRead.connect(lambda: on_ready_read(connection))
+
+    server = QtNetwork.QLocalServer()
+    server.setSocketOptions(QtNetwork.QLocalServer.UserAccessOption)
+    QtNetwork.QLocalServer.removeServer(SERVER_NAME)
+    if sys.platform != 'win32':
+        filepaths.make_dirs(SERVER_NAME)
+    server.newConnection.connect(on_new_connection)
+    if not server.listen(SERVER_NAME):
+        raise OSError(server.errorString())
+    return server